@@ -1,11 +1,16 @@
 import asyncio
+import bisect
+import functools
 import inspect
 import random
+import re
 import time
 import asyncmy
 import os
 import sys
+from collections import OrderedDict, deque
 from types import SimpleNamespace
+from fastapi.responses import PlainTextResponse
 from config_api import (MYSQL_DB, MYSQL_HOST, MYSQL_MAXSIZE, MYSQL_MINSIZE,
                             MYSQL_PASSWD, MYSQL_PORT, MYSQL_USER)
 
@@ -16,6 +21,54 @@ sys.stderr = os.fdopen(sys.stderr.fileno(), "w", 1)
 # 全域終止訊號
 terminate_event = asyncio.Event()
 
+# 伺服器端預備語句設定 (asyncmy 二進位協定 COM_STMT_PREPARE，驅動程式每條連線各自以 SQL 文字快取)
+STMT_CACHE_SIZE = 64  # 每條連線最多保留的預備語句數 (驅動程式 LRU 淘汰，只在 use_prepared 的查詢期間開啟)
+stmt_cache_stats = {"命中": 0, "未命中": 0, "淘汰": 0, "改用文字協定": 0}  # 依驅動程式每條連線的快取內容統計
+
+# SELECT 結果快取設定 (mysql_exec 傳入 cache_ttl 才會使用)
+QUERY_CACHE_SIZE = 1024  # 最多快取的查詢結果數 (LRU 淘汰)
+
+# 日誌設定 (mysql_exec 成功/重試日誌先放入佇列，由背景任務 log_writer 寫出，不佔用請求時間)
+LOG_MIN_LEVEL = 0  # 低於此等級的日誌直接略過 (不格式化、不入佇列)
+LOG_QUEUE_SIZE = 10000  # 佇列上限，滿了就丟棄並計數，不阻塞請求
+LOG_PARAMS_PREVIEW = 3  # 參數列表只記錄前幾組
+LOG_VALUE_MAX_CHARS = 500  # 單一欄位最多記錄的字元數
+log_queue = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+log_stats = {"已寫入": 0, "已丟棄": 0}
+
+# 連接池監控設定 (取得連線等待時間、連線持有時間、使用中/等待中數量的滾動統計)
+METRICS_WINDOW = 300  # 統計最近幾秒的樣本
+METRICS_MAX_SAMPLES = 10000  # 每項統計最多保留的樣本數
+
+# 連接池自動調整設定 (pool_controller 依取得連線等待時間與使用率，在最小/最大值之間調整目標連線數，
+# 有壓力時預先建立連線、閒置時回收；不限制取得連線，尖峰時連接池仍可直接擴充到 MYSQL_SIZE_MAX)
+POOL_AUTOSCALE = True  # False 時不預熱也不回收，連線數只由連接池依需求增加
+POOL_CONTROL_INTERVAL = 5  # 每隔幾秒評估一次
+POOL_CONTROL_WINDOW = 30  # 評估時使用最近幾秒的等待時間樣本
+POOL_GROW_WAIT = 0.05  # p95 等待秒數超過此值就擴大
+POOL_GROW_RATIO = 0.9  # 使用率 (使用中/目前連線數) 達到此值就擴大
+POOL_SHRINK_RATIO = 0.3  # 使用率低於此值且沒有等待時縮小
+POOL_IDLE_TIMEOUT = 300  # 閒置超過此秒數的連線會被關閉 (保留到目標連線數)
+POOL_PREWARM_SCHEDULE = []  # 尖峰前預熱: [("08:50", "10:30", 30), ...] (開始, 結束, 期間最少連線數)
+
+# 連線健康檢查設定 (取得連線時先處理閒置過久或存活過久的連線，避免請求中才遇到 2006/2013 再退避重試)
+CONN_PING_IDLE = 30  # 閒置超過此秒數的連線，取得時先 ping 確認
+CONN_PING_TIMEOUT = 2  # ping 逾時秒數，逾時視為失效連線
+CONN_MAX_LIFETIME = 3600  # 連線建立超過此秒數就關閉重建 (需小於 MySQL wait_timeout 與負載平衡器閒置逾時)
+CONN_SWEEP_INTERVAL = 10  # 背景巡檢間隔秒數，巡檢時 ping 閒置超過此秒數的連線，讓請求端不必等待 ping
+conn_health_stats = {"ping": 0, "ping失敗": 0, "超過存活時間": 0}
+
+# 查詢效能分析設定 (依去除常數後的 SQL 指紋彙總執行時間)
+SLOW_QUERY_THRESHOLD = 1.0  # 超過此秒數記入慢查詢紀錄
+SLOW_QUERY_LOG_SIZE = 200  # 慢查詢紀錄保留筆數
+QUERY_PROFILE_MAX_FINGERPRINTS = 2000  # 最多彙總的 SQL 指紋數，超過的歸入 "<其他>"
+# 每個指紋的耗時分佈以固定區間計數 (0.1 毫秒起每格 1.5 倍，約到 97 秒)，每個指紋只佔幾十個整數
+QUERY_PROFILE_BUCKETS = [0.0001 * 1.5 ** i for i in range(35)]
+
+# 批次寫入設定 (InsertBatcher 收集同一條 INSERT 的參數後以 executemany 一次寫入)
+INSERT_BATCH_WINDOW = 0.005  # 收集時間窗 (秒)
+INSERT_BATCH_MAX_ROWS = 500  # 累積到此筆數立即寫入
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -64,6 +117,20 @@ async def lifespan(app: FastAPI):
     # 將 mysql_pool 資源和管理器加入 FastAPI 應用狀態       
     app.state.mysql = mysql_pool
 
+    # 預備語句快取統計
+    app.state.stmt_cache_stats = stmt_cache_stats
+    # SELECT 結果快取
+    app.state.query_cache = query_cache
+    # 批次寫入
+    app.state.insert_batcher = insert_batcher
+    # 連接池監控 (亦可由 /metrics 以 Prometheus 格式讀取)
+    app.state.pool_metrics = pool_metrics
+    # 連接池自動調整 (目標連線數從下限開始，有壓力時調高並預熱，閒置時調低並回收)
+    pool_controller.target_size = pool_controller.floor()
+    app.state.pool_controller = pool_controller
+    # 查詢效能分析 (亦可由 /admin/query_stats 讀取)
+    app.state.query_profiler = query_profiler
+
     #API 使用統計或監控
     app.state.api_stats = {
     "總請求數": 0, "各端點請求數": {}, "平均處理時間": 0.0, "當前活躍請求數": 0,
@@ -100,6 +167,16 @@ async def lifespan(app: FastAPI):
             # 封裝所有狀態
             db_status = {
                 "MySQL連接池(當前/歷史/最小/最大)": f"{mysql_conn_size}/{getattr(app.state, 'mysql_highest_size', 'N/A')}/{MYSQL_SIZE_MIN}/{MYSQL_SIZE_MAX}",
+                "預備語句快取(命中/未命中/淘汰/改用文字協定)": f"{stmt_cache_stats['命中']}/{stmt_cache_stats['未命中']}/{stmt_cache_stats['淘汰']}/{stmt_cache_stats['改用文字協定']}",
+                "自動調整(目標/下限/已回收閒置)": f"{pool_controller.target_size}/{pool_controller.floor()}/{pool_controller.reaped}",
+                "自動調整(最近一次)": pool_controller.last_adjustment,
+                "連線健康檢查(ping/ping失敗/超過存活時間)": f"{conn_health_stats['ping']}/{conn_health_stats['ping失敗']}/{conn_health_stats['超過存活時間']}",
+                "取得連線等待秒數(p50/p95/p99)": pool_metrics.acquire_wait.format_percentiles(),
+                "連線持有秒數(p50/p95/p99)": pool_metrics.hold_time.format_percentiles(),
+                "等待中請求(當前/歷史最高)": f"{pool_metrics.waiting}/{pool_metrics.max_waiting}",
+                "日誌佇列(待寫入/已寫入/已丟棄)": f"{log_queue.qsize()}/{log_stats['已寫入']}/{log_stats['已丟棄']}",
+                "批次寫入(批次/筆數/待寫入)": f"{insert_batcher.stats['批次數']}/{insert_batcher.stats['筆數']}/{insert_batcher.pending_count()}",
+                "查詢結果快取(筆數/命中/未命中/失效)": f"{len(query_cache)}/{query_cache.stats['命中']}/{query_cache.stats['未命中']}/{query_cache.stats['失效']}",
             }
             combined_status = {"資料庫狀態": db_status}
             # 存入 app.state，方便其他地方讀取
@@ -115,6 +192,9 @@ async def lifespan(app: FastAPI):
     # 啟動所有背景任務並統一管理
     background_tasks = [
         asyncio.create_task(check_pool_status()),
+        asyncio.create_task(log_writer()),
+        asyncio.create_task(pool_controller.run()),
+        asyncio.create_task(connection_sweeper()),
 
     ]
     app.state.background_tasks = background_tasks
@@ -125,6 +205,8 @@ async def lifespan(app: FastAPI):
     finally:
         # 輸出關閉訊息
         print("lifespan.shutdown: 應用程式準備關閉，開始清理資源...")
+        # 終止訊號會讓 mysql_exec 停止執行，必須先寫入尚未送出的批次
+        await insert_batcher.close()
         terminate_event.set()
 
         # 優雅地取消所有背景任務
@@ -133,6 +215,11 @@ async def lifespan(app: FastAPI):
         await asyncio.gather(*app.state.background_tasks, return_exceptions=True)
         print("lifespan.shutdown: 所有背景任務已成功取消")
 
+        # 輸出查詢效能彙總，找出佔用最多資料庫時間的語句
+        print("lifespan.shutdown: 查詢效能彙總 (依總耗時排序)")
+        for item in query_profiler.summary(limit=20):
+            print("lifespan.shutdown:", item)
+
         # 清理 MySQL 連接池
         if hasattr(app.state, 'mysql') and app.state.mysql:
             try:
@@ -163,18 +250,677 @@ app.add_middleware(
 # 核心函數 (Core Functions)
 # -----------------------------------------------------------------------------
 
+# 將參數縮短後再寫入日誌 (executemany 的參數可能有上千組)
+def summarize_value(value):
+    if isinstance(value, (list, tuple)) and len(value) > LOG_PARAMS_PREVIEW:
+        preview = ", ".join(str(item) for item in value[:LOG_PARAMS_PREVIEW])
+        text = f"[{preview}, ...] (共 {len(value)} 組)"
+    else:
+        text = str(value)
+    if len(text) > LOG_VALUE_MAX_CHARS:
+        text = text[:LOG_VALUE_MAX_CHARS] + f"...(共 {len(text)} 字)"
+    return text
+
+
+# 延遲格式化的日誌：請求路徑只把模板與原始值放入佇列，格式化與寫入交給 log_writer
+def log_lazy(level, def_name, message, detail, **fields):
+    if level < LOG_MIN_LEVEL:
+        return
+    try:
+        log_queue.put_nowait((level, def_name, message, detail, fields))
+    except asyncio.QueueFull:
+        log_stats["已丟棄"] += 1
+
+
+async def write_log_record(record):
+    level, def_name, message, detail, fields = record
+    fields = {key: summarize_value(value) for key, value in fields.items()}
+    try:
+        await logsys(level, def_name, message.format(**fields), detail.format(**fields))
+        log_stats["已寫入"] += 1
+    except Exception as e:
+        print("log_writer", "寫入日誌失敗", str(e))
+
+
+# 背景任務：依序寫出佇列中的日誌，關閉時先寫完剩餘的日誌
+async def log_writer():
+    try:
+        while True:
+            await write_log_record(await log_queue.get())
+    except asyncio.CancelledError:
+        while not log_queue.empty():
+            await write_log_record(log_queue.get_nowait())
+        raise
+
+
+# 依驅動程式的預備語句快取 (conn._stmt_cache，SQL -> PreparedStatement，重新連線時清空) 記錄命中狀況
+# cached 是執行前快取中的預備語句
+def record_prepared(conn, query, params, cached, size_before):
+    stmt = conn._stmt_cache.get(query)
+    if stmt is None or stmt.parameter_count != len(params):
+        # 驅動程式無法預備 (不支援的語句、參數數量不符等)，已改用文字協定執行
+        stmt_cache_stats["改用文字協定"] += 1
+    elif cached is stmt:
+        stmt_cache_stats["命中"] += 1
+    else:
+        stmt_cache_stats["未命中"] += 1
+        stmt_cache_stats["淘汰"] += max(0, size_before + 1 - len(conn._stmt_cache))
+
+
+# 執行單條查詢 (use_prepared 時交給驅動程式以二進位預備語句執行，同一條連線上相同的 SQL 只需解析一次)
+async def execute_query(conn, cur, query, params, use_prepared):
+    # 驅動程式只對帶位置參數的 execute 使用預備語句，具名參數 (dict) 走一般路徑
+    if use_prepared and params is not None and not isinstance(params, dict):
+        params = tuple(params)
+        cached = conn._stmt_cache.get(query)
+        size_before = len(conn._stmt_cache)
+        # 預備語句快取只在這次 execute 期間開啟，executemany 與呼叫端沿用連線執行的語句仍走文字協定
+        conn._stmt_cache_size = STMT_CACHE_SIZE
+        try:
+            await cur.execute(query, params)
+        finally:
+            conn._stmt_cache_size = 0
+        record_prepared(conn, query, params, cached, size_before)
+        return
+    # 一般路徑：先在用戶端組好 SQL 再以文字協定送出
+    await cur.execute(query if params is None else cur.mogrify(query, params))
+
+
+# 解析 SQL 中引用的資料表名稱 (小寫、去除反引號與資料庫前綴)，用於快取失效
+SQL_TOKEN_PATTERN = re.compile(r"(?:`[^`]+`|\w+)(?:\.(?:`[^`]+`|\w+))*|[(),;]")
+TABLE_KEYWORDS = {"FROM", "JOIN", "UPDATE", "INTO", "STRAIGHT_JOIN", "TABLE", "TRUNCATE", "INSERT", "REPLACE"}
+# 資料表名稱前可能出現的修飾字 (INSERT IGNORE INTO t、TRUNCATE TABLE t、DROP TABLE IF EXISTS t 等)，略過後繼續找資料表
+TABLE_MODIFIERS = {"INTO", "TABLE", "LOW_PRIORITY", "DELAYED", "HIGH_PRIORITY", "IGNORE", "IF", "NOT", "EXISTS"}
+TABLE_LIST_KEYWORDS = {"FROM", "UPDATE"}  # 之後可接逗號分隔的多個資料表
+TABLE_LIST_END = {
+    "WHERE", "SET", "GROUP", "ORDER", "LIMIT", "HAVING", "ON", "USING", "JOIN", "LEFT", "RIGHT",
+    "INNER", "OUTER", "CROSS", "STRAIGHT_JOIN", "NATURAL", "UNION", "FOR", "VALUES", "SELECT",
+    "WINDOW", "LOCK", "(", ")", ";",
+}
+
+
+def extract_tables(query):
+    tables = set()
+    expect_table = False  # 下一個 token 是資料表名稱
+    in_table_list = False  # 位於 FROM/UPDATE 的資料表列表中 (逗號後接下一個資料表)
+    for token in SQL_TOKEN_PATTERN.findall(query):
+        upper = token.upper()
+        if expect_table:
+            if upper in TABLE_MODIFIERS:
+                continue
+            expect_table = False
+            if token != "(":  # "(" 代表子查詢，內層的 FROM 會另外解析
+                tables.add(token.replace("`", "").split(".")[-1].lower())
+                continue
+        if upper in TABLE_KEYWORDS:
+            expect_table = True
+            in_table_list = upper in TABLE_LIST_KEYWORDS
+        elif in_table_list and token == ",":
+            expect_table = True
+        elif upper in TABLE_LIST_END:
+            in_table_list = False
+    return tables
+
+
+# 複製查詢結果，避免呼叫端修改到快取內容 (支援 dict 列、tuple 格式與欄式格式)
+def copy_result(result):
+    if isinstance(result, list):
+        return [dict(row) if isinstance(row, dict) else row for row in result]
+    if isinstance(result, dict):
+        return {key: list(value) if isinstance(value, list) else value for key, value in result.items()}
+    if isinstance(result, tuple):
+        return tuple(list(item) if isinstance(item, list) else item for item in result)
+    return result
+
+
+# SELECT 結果快取：TTL 過期 + LRU 容量上限，更新時依資料表失效
+class QueryResultCache:
+    def __init__(self, max_size=QUERY_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # 鍵值 -> (過期時間, 讀取的資料表, 結果)
+        self.table_keys = {}  # 資料表 -> 讀取該表的快取鍵值
+        self.generations = {}  # 資料表 -> 失效次數，用來丟棄查詢期間已被更新的結果
+        self.epoch = 0  # 整個快取清空的次數 (無法判斷資料表的更新會清空全部)
+        self.stats = {"命中": 0, "未命中": 0, "失效": 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self.remove(key)
+            self.stats["未命中"] += 1
+            return False, None
+        self.entries.move_to_end(key)
+        self.stats["命中"] += 1
+        return True, copy_result(entry[2])
+
+    def snapshot(self, tables):
+        return (self.epoch,) + tuple(self.generations.get(table, 0) for table in sorted(tables))
+
+    def set(self, key, result, ttl, tables, snapshot):
+        # 查詢執行期間資料表已被更新，結果可能是舊的，不寫入快取
+        if self.snapshot(tables) != snapshot:
+            return
+        self.remove(key)
+        self.entries[key] = (time.monotonic() + ttl, tables, copy_result(result))
+        for table in tables:
+            self.table_keys.setdefault(table, set()).add(key)
+        while len(self.entries) > self.max_size:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for table in entry[1]:
+            keys = self.table_keys.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.table_keys[table]
+
+    def invalidate_tables(self, tables):
+        for table in tables:
+            self.generations[table] = self.generations.get(table, 0) + 1
+            for key in list(self.table_keys.get(table, ())):
+                self.remove(key)
+                self.stats["失效"] += 1
+
+    def clear(self):
+        self.epoch += 1
+        self.stats["失效"] += len(self.entries)
+        self.entries.clear()
+        self.table_keys.clear()
+
+    # 讓更新語句寫入的資料表失效；無法判斷資料表 (預存程序、LOAD DATA 等) 時清空整個快取
+    def invalidate_writes(self, queries):
+        queries = [queries] if isinstance(queries, str) else queries
+        written_tables = [extract_tables(query) for query in queries]
+        if all(written_tables):
+            self.invalidate_tables(set().union(*written_tables))
+        else:
+            self.clear()
+
+
+query_cache = QueryResultCache()
+
+
+# 未自動提交的連線 (FOR UPDATE 關閉了自動提交) 寫入要到 reset_connection 才提交，記下來屆時再讓快取失效
+def defer_cache_invalidation(conn, update_queries):
+    if conn is None or conn.get_autocommit():
+        return
+    queries = [update_queries] if isinstance(update_queries, str) else list(update_queries)
+    conn._cache_pending_writes = (getattr(conn, "_cache_pending_writes", None) or []) + queries
+
+
+# 依取得方式與列格式決定游標類別 (stream 使用不緩衝的伺服器端游標；非 dict 格式使用 tuple 列)
+def cursor_class(fetch_method, row_format):
+    prefix = "SS" if fetch_method == "stream" else ""
+    name = "DictCursor" if row_format == "dict" else "Cursor"
+    return getattr(asyncmy.cursors, prefix + name)
+
+
+# 取得查詢結果的欄位名稱 (所有列共用同一份)
+def column_names(cur):
+    return [column[0] for column in cur.description or ()]
+
+
+# 將 tuple 列轉換為 row_format 指定的格式
+def format_rows(cur, rows, fetch_method, row_format):
+    if row_format == "tuple":
+        return column_names(cur), rows
+    if row_format == "columnar":
+        columns = column_names(cur)
+        if fetch_method == "one":
+            return dict(zip(columns, rows)) if rows is not None else None
+        return {column: [row[i] for row in rows] for i, column in enumerate(columns)}
+    return rows
+
+
+# 滾動統計：保留最近 METRICS_WINDOW 秒的樣本計算百分位數，另累計總次數與總和 (Prometheus summary)
+class RollingHistogram:
+    def __init__(self, window=METRICS_WINDOW, max_samples=METRICS_MAX_SAMPLES):
+        self.window = window
+        self.samples = deque(maxlen=max_samples)  # (時間, 數值)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        now = time.monotonic()
+        # 順便丟掉超出時間窗的樣本，避免長時間沒有讀取百分位數時累積到上限
+        cutoff = now - self.window
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        self.samples.append((now, value))
+        self.count += 1
+        self.total += value
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99), window=None):
+        now = time.monotonic()
+        cutoff = now - self.window
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        # window: 只取最近幾秒的樣本 (例如自動調整只看近期負載)
+        recent_cutoff = now - window if window is not None else cutoff
+        values = sorted(value for sampled_at, value in self.samples if sampled_at >= recent_cutoff)
+        if not values:
+            return {q: 0.0 for q in quantiles}
+        return {q: values[min(len(values) - 1, int(q * len(values)))] for q in quantiles}
+
+    def format_percentiles(self):
+        return "/".join(f"{value:.3f}" for value in self.percentiles().values())
+
+
+# 連接池監控：在取得與歸還連線時記錄等待時間、持有時間與使用量
+class PoolMetrics:
+    def __init__(self):
+        self.acquire_wait = RollingHistogram()  # 取得連線等待秒數
+        self.hold_time = RollingHistogram()  # 連線持有秒數 (取得到歸還)
+        self.in_use = RollingHistogram()  # 取得連線時的使用中連線數
+        self.waiters = RollingHistogram()  # 取得連線時的等待中請求數
+        self.waiting = 0
+        self.max_waiting = 0
+
+    async def acquire(self, pool):
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        self.waiters.observe(self.waiting - 1)
+        start_time = time.perf_counter()
+        try:
+            conn = await ensure_healthy(pool, await pool.acquire())
+        finally:
+            self.waiting -= 1
+        now = time.perf_counter()
+        self.acquire_wait.observe(now - start_time)
+        self.in_use.observe(pool.size - pool.freesize)
+        conn._metrics_acquired_at = now
+        return conn
+
+    def record_release(self, conn):
+        now = time.perf_counter()
+        acquired_at = getattr(conn, "_metrics_acquired_at", None)
+        if acquired_at is not None:
+            self.hold_time.observe(now - acquired_at)
+            conn._metrics_acquired_at = None
+        conn._metrics_released_at = now  # 供閒置回收判斷
+
+    def render_prometheus(self, pool):
+        lines = []
+        for name, histogram, help_text in (
+            ("mysql_pool_acquire_wait_seconds", self.acquire_wait, "Time spent waiting to acquire a pooled connection"),
+            ("mysql_pool_hold_seconds", self.hold_time, "Time a connection is held before release"),
+            ("mysql_pool_in_use_at_acquire", self.in_use, "Connections in use when a connection is acquired"),
+            ("mysql_pool_waiters_at_acquire", self.waiters, "Requests already waiting when a connection is requested"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} summary")
+            for quantile, value in histogram.percentiles().items():
+                lines.append(f'{name}{{quantile="{quantile}"}} {value}')
+            lines.append(f"{name}_sum {histogram.total}")
+            lines.append(f"{name}_count {histogram.count}")
+        gauges = [("mysql_pool_waiting", self.waiting, "Requests currently waiting for a connection")]
+        if pool is not None:
+            gauges += [
+                ("mysql_pool_size", pool.size, "Open connections in the pool"),
+                ("mysql_pool_free", pool.freesize, "Idle connections in the pool"),
+                ("mysql_pool_in_use", pool.size - pool.freesize, "Connections currently checked out"),
+                ("mysql_pool_maxsize", pool.maxsize, "Maximum pool size"),
+                ("mysql_pool_target_size", pool_controller.target_size or pool.size, "Autoscaled target connection count"),
+            ]
+        for name, value, help_text in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+pool_metrics = PoolMetrics()
+
+
+# SQL 指紋：去除註解、字串與數字常數，IN 列表合併，空白正規化 (相同形狀的查詢彙總在一起)
+# 常數與註解放在同一個正規表示式，由左到右比對，字串內的 # 或 -- 不會被當成註解
+SQL_LITERAL_OR_COMMENT_PATTERN = re.compile(
+    r"(?P<literal>'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|\b\d+(?:\.\d+)?\b|%s|%\(\w+\)s)"
+    r"|/\*.*?\*/|--[^\n]*|#[^\n]*",
+    re.DOTALL,
+)
+SQL_IN_LIST_PATTERN = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+@functools.lru_cache(maxsize=4096)
+def sql_fingerprint(query):
+    fingerprint = SQL_LITERAL_OR_COMMENT_PATTERN.sub(lambda m: "?" if m.group("literal") else " ", query)
+    fingerprint = SQL_IN_LIST_PATTERN.sub("(?+)", fingerprint)
+    return " ".join(fingerprint.split()).lower()
+
+
+# 固定區間的耗時分佈 (只記錄各區間的次數，百分位數取所在區間的上限)
+class BucketHistogram:
+    def __init__(self, bounds=QUERY_PROFILE_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最後一格是超過最大區間的
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99)):
+        result = {}
+        for q in quantiles:
+            if not self.count:
+                result[q] = 0.0
+                continue
+            target = min(self.count - 1, int(q * self.count))
+            seen = 0
+            for index, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen > target:
+                    break
+            result[q] = self.bounds[min(index, len(self.bounds) - 1)]
+        return result
+
+
+# 查詢效能分析：依 SQL 指紋彙總次數、總耗時、最大耗時與百分位數，並保留慢查詢紀錄
+class QueryProfiler:
+    def __init__(self):
+        self.stats = {}  # 指紋 -> {"次數", "總耗時", "最大耗時", "耗時分佈"}
+        self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+    def record(self, query, elapsed, from_where):
+        fingerprint = sql_fingerprint(query)
+        stat = self.stats.get(fingerprint)
+        if stat is None:
+            if len(self.stats) >= QUERY_PROFILE_MAX_FINGERPRINTS:
+                fingerprint = "<其他>"
+                stat = self.stats.get(fingerprint)
+            if stat is None:
+                stat = self.stats[fingerprint] = {
+                    "次數": 0, "總耗時": 0.0, "最大耗時": 0.0, "耗時分佈": BucketHistogram(),
+                }
+        stat["次數"] += 1
+        stat["總耗時"] += elapsed
+        stat["最大耗時"] = max(stat["最大耗時"], elapsed)
+        stat["耗時分佈"].observe(elapsed)
+        if elapsed >= SLOW_QUERY_THRESHOLD:
+            self.slow_queries.append({
+                "時間": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "耗時": round(elapsed, 4),
+                "指紋": fingerprint,
+                "調用API": from_where,
+            })
+
+    def summary(self, limit=50, order_by="總耗時"):
+        items = sorted(self.stats.items(), key=lambda item: item[1][order_by], reverse=True)[:limit]
+        result = []
+        for fingerprint, stat in items:
+            p50, p95, p99 = stat["耗時分佈"].percentiles().values()
+            result.append({
+                "指紋": fingerprint,
+                "次數": stat["次數"],
+                "總耗時": round(stat["總耗時"], 4),
+                "平均耗時": round(stat["總耗時"] / stat["次數"], 4),
+                "最大耗時": round(stat["最大耗時"], 4),
+                "p50": round(p50, 4), "p95": round(p95, 4), "p99": round(p99, 4),
+            })
+        return result
+
+
+query_profiler = QueryProfiler()
+
+
+# 歸還連線並記錄持有時間 (回傳 pool.release 的結果，呼叫端可選擇是否 await)
+def release_connection(pool, conn):
+    pool_metrics.record_release(conn)
+    return pool.release(conn)
+
+
+# 連接池自動調整：依近期等待時間與使用率調整目標連線數，據此預熱或回收閒置連線 (不限制取得連線)
+class PoolController:
+    def __init__(self):
+        self.target_size = None  # 目標連線數 (lifespan 建立連接池後設定)
+        self.reaped = 0  # 累計回收的閒置連線數
+        self.last_adjustment = "無"
+        self.adjustments = deque(maxlen=50)
+
+    # 目前的下限：MYSQL_SIZE_MIN 或預熱排程期間要求的連線數
+    def floor(self):
+        now = time.strftime("%H:%M")
+        floor = MYSQL_SIZE_MIN
+        for start, end, size in POOL_PREWARM_SCHEDULE:
+            in_window = start <= now < end if start <= end else (now >= start or now < end)
+            if in_window:
+                floor = max(floor, size)
+        return min(floor, MYSQL_SIZE_MAX)
+
+    def record_adjustment(self, message):
+        self.last_adjustment = f"{time.strftime('%H:%M:%S')} {message}"
+        self.adjustments.append(self.last_adjustment)
+        print("pool_controller", message)
+
+    # 只調整要保留/預先建立的連線數，不限制取得連線 (閒置連線直接可用，尖峰時連接池自行擴充)
+    async def adjust(self, pool):
+        floor = self.floor()
+        wait_p95 = pool_metrics.acquire_wait.percentiles((0.95,), window=POOL_CONTROL_WINDOW)[0.95]
+        in_use = pool.size - pool.freesize
+        ratio = in_use / pool.size if pool.size else 0
+        step = max(1, MYSQL_SIZE_MAX // 4)
+
+        new_target = self.target_size
+        if wait_p95 > POOL_GROW_WAIT or ratio >= POOL_GROW_RATIO:
+            new_target = max(new_target, pool.size) + step  # 有壓力時預先多建立連線
+        elif ratio <= POOL_SHRINK_RATIO:
+            new_target -= step
+        new_target = min(MYSQL_SIZE_MAX, max(floor, new_target))
+        if new_target != self.target_size:
+            self.record_adjustment(
+                f"目標連線數 {self.target_size} -> {new_target} (使用中 {in_use}，p95 等待 {wait_p95:.3f} 秒)"
+            )
+            self.target_size = new_target
+
+        await self.reap_idle(pool, new_target)
+        await self.prewarm(pool, new_target)
+
+    # 關閉閒置過久的連線 (連接池先取出最早歸還的閒置連線，該連線不夠舊就代表其他也不夠舊)
+    async def reap_idle(self, pool, target):
+        reaped = 0
+        while pool.freesize > 0 and pool.size > target:
+            conn = await pool.acquire()
+            released_at = getattr(conn, "_metrics_released_at", None)
+            if released_at is None or time.perf_counter() - released_at < POOL_IDLE_TIMEOUT:
+                await pool.release(conn)
+                break
+            conn.close()
+            await pool.release(conn)  # 已關閉的連線不會放回連接池
+            reaped += 1
+        if reaped:
+            self.reaped += reaped
+            self.record_adjustment(f"回收閒置連線 {reaped} 條 (目前 {pool.size} 條)")
+
+    # 預熱：連線數不足目標 (預熱排程的下限或有壓力時調高的目標) 時，預先建立連線
+    async def prewarm(self, pool, target):
+        missing = target - pool.size
+        if missing <= 0:
+            return
+        # 連同現有閒置連線一起取出，才會真正建立 missing 條新連線
+        conns = await asyncio.gather(
+            *(pool.acquire() for _ in range(missing + pool.freesize)), return_exceptions=True
+        )
+        now = time.perf_counter()
+        for conn in conns:
+            if not isinstance(conn, BaseException):
+                conn._metrics_released_at = now
+                await pool.release(conn)
+        self.record_adjustment(f"預熱連線至 {pool.size} 條 (目標 {target})")
+
+    # 背景任務：定期評估並調整
+    async def run(self):
+        while not terminate_event.is_set():
+            pool = getattr(app.state, "mysql", None)
+            if POOL_AUTOSCALE and pool is not None and self.target_size is not None:
+                try:
+                    await self.adjust(pool)
+                except Exception as e:
+                    print("pool_controller", "自動調整失敗", str(e))
+            for _ in range(POOL_CONTROL_INTERVAL):
+                if terminate_event.is_set():
+                    return
+                await asyncio.sleep(1)
+
+
+pool_controller = PoolController()
+
+
+# 連線健康檢查：存活過久的關閉重建，閒置過久的先 ping (失敗同樣重建)，回傳可用的連線
+async def ensure_healthy(pool, conn, ping_idle=CONN_PING_IDLE):
+    try:
+        # 每次重建最多換到 MYSQL_SIZE_MAX 條，資料庫無法連線時由 pool.acquire 拋出例外
+        for _ in range(MYSQL_SIZE_MAX):
+            now = time.perf_counter()
+            created_at = getattr(conn, "_health_created_at", None)
+            if created_at is None:
+                conn._health_created_at = created_at = now  # 第一次取得時視為建立時間
+            if now - created_at > CONN_MAX_LIFETIME:
+                conn_health_stats["超過存活時間"] += 1
+            else:
+                # 最後確認可用的時間：歸還或上次 ping 成功，取較晚者 (新建立的連線兩者皆無)
+                last_seen = max(
+                    getattr(conn, "_metrics_released_at", None) or 0,
+                    getattr(conn, "_health_checked_at", None) or 0,
+                )
+                if not last_seen or now - last_seen < ping_idle:
+                    return conn
+                conn_health_stats["ping"] += 1
+                try:
+                    await asyncio.wait_for(conn.ping(reconnect=False), CONN_PING_TIMEOUT)
+                    conn._health_checked_at = time.perf_counter()
+                    return conn
+                except Exception:
+                    conn_health_stats["ping失敗"] += 1
+            # 關閉後歸還，連接池會丟棄已關閉的連線，再取一條 (必要時建立新連線)
+            stale, conn = conn, None
+            stale.close()
+            await pool.release(stale)
+            conn = await pool.acquire()
+        return conn
+    except BaseException:
+        # 檢查途中被取消或出錯：手上的連線狀態不明，關閉並歸還 (pool.release 同步生效)，避免永久佔用連接池
+        if conn is not None:
+            conn.close()
+            pool.release(conn)
+        raise
+
+
+# 背景巡檢：依序取出閒置連線做健康檢查 (ping 或重建)，讓請求取得的連線大多已確認可用
+async def connection_sweeper():
+    while not terminate_event.is_set():
+        pool = getattr(app.state, "mysql", None)
+        if pool is not None:
+            try:
+                # 連接池先取出最早歸還的閒置連線，遇到不需檢查的連線代表其餘也不需要
+                for _ in range(pool.freesize):
+                    original = await pool.acquire()
+                    checked = getattr(original, "_health_checked_at", None)
+                    conn = await ensure_healthy(pool, original, ping_idle=CONN_SWEEP_INTERVAL)
+                    await pool.release(conn)
+                    if conn is original and getattr(conn, "_health_checked_at", None) == checked:
+                        break
+            except Exception as e:
+                print("connection_sweeper", "連線巡檢失敗", str(e))
+        for _ in range(CONN_SWEEP_INTERVAL):
+            if terminate_event.is_set():
+                return
+            await asyncio.sleep(1)
+
+
+# stream 模式的非同步迭代器：逐列 (或每 fetch_size 列) 從伺服器端游標讀取，記憶體用量固定
+# owns_connection 為 True 時，讀完、aclose() 或 async with 結束後由這裡歸還連線 (呼叫端應以 async with 使用)；
+# 沒有關閉就被回收時 (例如還沒開始讀就拋出例外)，由 __del__ 關閉並歸還自己借用的連線
+class RowStream:
+    def __init__(self, conn, cur, fetch_size, owns_connection):
+        self.conn = conn
+        self.cur = cur
+        self.fetch_size = fetch_size
+        self.owns_connection = owns_connection
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        try:
+            if self.fetch_size:
+                item = await self.cur.fetchmany(self.fetch_size)
+                exhausted = not item
+            else:
+                item = await self.cur.fetchone()
+                exhausted = item is None
+        except BaseException:
+            await self.close(finished=False)
+            raise
+        if exhausted:
+            await self.close(finished=True)
+            raise StopAsyncIteration
+        return item
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.close(finished=False)
+
+    async def close(self, finished):
+        if self.closed:
+            return
+        self.closed = True
+        if finished or not self.owns_connection:
+            # 讀完時直接關閉游標；外部連線中止時需讀掉剩餘結果，連線才能繼續使用
+            try: await self.cur.close()
+            except Exception: pass
+            if self.owns_connection:
+                await reset_connection(self.conn)
+        else:
+            # 自己的連線中止時，剩餘結果可能很大，直接關閉連線 (連接池會丟棄已關閉的連線)
+            self.abort()
+
+    def abort(self):
+        try: self.conn.close()
+        except Exception: pass
+        release_connection(app.state.mysql, self.conn)
+
+    def __del__(self):
+        if not self.closed and self.owns_connection:
+            self.closed = True
+            try:
+                self.abort()
+            except Exception:
+                pass
+
+
 # 通用的資料庫操作函數
 async def mysql_exec(
     from_where=None,  # 來源/調用API名稱，用於日誌記錄
     select_query=None,  # SELECT 查詢語句 (字串)
     select_params=None,  # SELECT 查詢參數 (元組或列表)
-    fetch_method="one",  # 查詢結果獲取方式: "one" (一條) 或 "all" (全部)
+    fetch_method="one",  # 查詢結果獲取方式: "one" (一條)、"all" (全部) 或 "stream" (RowStream，伺服器端游標逐批讀取，需以 async with 使用或讀完)
     update_queries=None,  # UPDATE/INSERT/DELETE 查詢語句列表 (字串列表)
     update_params_list=None,  # UPDATE/INSERT/DELETE 查詢參數列表 (列表的列表/元組)
     lock=False,  # 是否開啟事務 (START TRANSACTION 和 COMMIT/ROLLBACK)
     use_executemany=False,  # 是否使用 executemany 批量執行更新
     conn=None,  # 可選: 預先存在的連接對象
     cur=None,  # 可選: 預先存在的游標對象
+    use_prepared=False,  # 是否使用伺服器端預備語句 (高頻查詢免去重複解析，不適用 executemany)
+    cache_ttl=None,  # 可選: SELECT 結果快取秒數，命中時不經過連接池，回傳的 conn/cur 為 None
+    fetch_size=None,  # stream 模式: None 逐列產出，N 則每次產出 N 列的列表
+    row_format="dict",  # 列格式: "dict" (每列一個字典)、"tuple" (回傳 (欄位列表, tuple 列)) 或 "columnar" ({欄位: [值, ...]})
 ):
     try:
         def_name = inspect.currentframe().f_code.co_name
@@ -189,6 +935,27 @@ async def mysql_exec(
     retries = 0
     total_wait_time = 0
 
+    # stream 模式的結果需讀完才能在同一條連線執行其他語句，不能與更新或事務混用
+    if fetch_method == "stream" and (update_queries or lock):
+        raise ValueError("fetch_method='stream' 不可與 update_queries 或 lock 同時使用。")
+    if row_format not in ("dict", "tuple", "columnar"):
+        raise ValueError("無效的 row_format,請使用 'dict'、'tuple' 或 'columnar'。")
+    if row_format == "columnar" and fetch_method == "stream":
+        raise ValueError("row_format='columnar' 不支援 fetch_method='stream'。")
+
+    # 查詢結果快取：僅限單純 SELECT (無更新、無事務、非 FOR UPDATE、未傳入外部連線)
+    cache_key = cache_tables = cache_snapshot = None
+    if (
+        cache_ttl and select_query and not update_queries and not lock and fetch_method != "stream"
+        and conn is None and "FOR UPDATE" not in select_query.upper()
+    ):
+        cache_key = (select_query, repr(select_params), fetch_method, row_format)
+        is_hit, cached_result = query_cache.get(cache_key)
+        if is_hit:
+            return cached_result, None, None
+        cache_tables = extract_tables(select_query)
+        cache_snapshot = query_cache.snapshot(cache_tables)
+
     mysql_pool = app.state.mysql
 
     # 標記變數：判斷連線是這裡建立的，還是外面傳進來的
@@ -200,12 +967,16 @@ async def mysql_exec(
     ):
         start_time = time.perf_counter()  # 記錄本次嘗試的開始時間
         if conn is None or cur is None:
-            conn = await mysql_pool.acquire()
+            conn = await pool_metrics.acquire(mysql_pool)
             # 標記：這是我借的，我有責任還
             created_new_connection = True 
             
-            # 動態導入 DictCursor
-            dict_cursor = getattr(asyncmy.cursors, "DictCursor")
+            # 動態導入 DictCursor (主游標會回傳給呼叫端沿用，一律為 DictCursor；
+            # stream 模式改用伺服器端游標，此時連線與游標不回傳給呼叫端)
+            if select_query and fetch_method == "stream":
+                dict_cursor = cursor_class(fetch_method, row_format)
+            else:
+                dict_cursor = cursor_class("one", "dict")
             cur = conn.cursor(dict_cursor)
             
         try:
@@ -217,25 +988,56 @@ async def mysql_exec(
                 # 如果查詢包含 "FOR UPDATE"，則禁用自動提交
                 if "FOR UPDATE" in select_query.upper():
                     await conn.autocommit(False)
-                await cur.execute(select_query, select_params)
-                if fetch_method == "one":
-                    select_result = await cur.fetchone()
-                elif fetch_method == "all":
-                    select_result = await cur.fetchall()
-                else:
-                    raise ValueError("無效的 fetch_method,請使用 'one' 或 'all'。")
+                if fetch_method == "stream":
+                    # 外部傳入的游標是緩衝式的，另開一個伺服器端游標
+                    stream_cur = cur if created_new_connection else conn.cursor(cursor_class(fetch_method, row_format))
+                    query_start = time.perf_counter()
+                    await execute_query(conn, stream_cur, select_query, select_params, use_prepared)
+                    query_profiler.record(select_query, time.perf_counter() - query_start, from_where)
+                    select_result = RowStream(conn, stream_cur, fetch_size, created_new_connection)
+                    if row_format == "tuple":
+                        select_result = (column_names(stream_cur), select_result)
+                    # 自己借用的連線交由 RowStream 在讀完、aclose() 或 async with 結束時歸還，呼叫端不需 reset_connection
+                    if created_new_connection:
+                        return select_result, None, None
+                    return select_result, conn, cur
+                # 主游標是 DictCursor，非 dict 格式另開暫時的 tuple 游標 (避免每列建立字典)
+                select_cur = cur
+                if row_format != "dict":
+                    select_cur = conn.cursor(cursor_class(fetch_method, row_format))
+                try:
+                    query_start = time.perf_counter()
+                    await execute_query(conn, select_cur, select_query, select_params, use_prepared)
+                    if fetch_method == "one":
+                        select_result = await select_cur.fetchone()
+                    elif fetch_method == "all":
+                        select_result = await select_cur.fetchall()
+                    else:
+                        raise ValueError("無效的 fetch_method,請使用 'one'、'all' 或 'stream'。")
+                    query_profiler.record(select_query, time.perf_counter() - query_start, from_where)
+                    select_result = format_rows(select_cur, select_result, fetch_method, row_format)
+                finally:
+                    if select_cur is not cur:
+                        await select_cur.close()
+                if cache_key is not None:
+                    query_cache.set(cache_key, select_result, cache_ttl, cache_tables, cache_snapshot)
 
             # 執行更新 (UPDATE/INSERT/DELETE) 操作
             if update_queries and update_params_list:
+                # 執行前先讓快取失效 (未開事務時每條語句各自提交，中途失敗前的寫入也已生效)
+                query_cache.invalidate_writes(update_queries)
                 if use_executemany:
                     # 使用 executemany 批量執行單個查詢語句的多組參數
+                    query_start = time.perf_counter()
                     await cur.executemany(update_queries, update_params_list)
+                    query_profiler.record(update_queries, time.perf_counter() - query_start, from_where)
                     rowcount = cur.rowcount
-                    await logsys(
+                    log_lazy(
                         0,
                         def_name,
-                        f"執行更新: {update_queries}, 參數: {update_params_list}, 影響行數: {rowcount}",
-                        f"調用API: {from_where}"
+                        "執行更新: {query}, 參數: {params}, 影響行數: {rowcount}",
+                        "調用API: {from_where}",
+                        query=update_queries, params=update_params_list, rowcount=rowcount, from_where=from_where,
                     )
                     select_result = rowcount  # 將影響行數作為結果返回
                 else:
@@ -243,22 +1045,35 @@ async def mysql_exec(
                     for update_query, update_params in zip(
                         update_queries, update_params_list
                     ):
-                        await cur.execute(update_query, update_params)
+                        query_start = time.perf_counter()
+                        await execute_query(conn, cur, update_query, update_params, use_prepared)
+                        query_profiler.record(update_query, time.perf_counter() - query_start, from_where)
                         rowcount = cur.rowcount
-                        await logsys(
+                        log_lazy(
                             0,
                             def_name,
-                            f"執行更新: {update_query}, 參數: {update_params}, 影響行數: {rowcount}",
-                            f"調用API: {from_where}"
+                            "執行更新: {query}, 參數: {params}, 影響行數: {rowcount}",
+                            "調用API: {from_where}",
+                            query=update_query, params=update_params, rowcount=rowcount, from_where=from_where,
                         )
                         select_result = rowcount  # 將最後一個查詢的影響行數作為結果返回
 
             # 如果 lock 為 True，則提交事務
             if lock:
                 await cur.execute("COMMIT")
+            if update_queries and update_params_list:
+                # 執行期間讀到舊資料的查詢可能已寫入快取，完成後再失效一次
+                query_cache.invalidate_writes(update_queries)
+                if not lock:
+                    defer_cache_invalidation(conn, update_queries)
             # 成功時，連線的所有權轉移給 Return 值，這裡不釋放
             return select_result, conn, cur
         except Exception as e:
+            if update_queries and update_params_list:
+                # 失敗前已提交的語句可能已改動資料
+                query_cache.invalidate_writes(update_queries)
+                if not lock:
+                    defer_cache_invalidation(conn, update_queries)
             # 動態導入 MySQLError
             mysql_error = getattr(asyncmy.errors, "MySQLError")
             # Rollback 嘗試
@@ -274,7 +1089,7 @@ async def mysql_exec(
                     99,
                     def_name,
                     f"第{retries + 1}次重試實際運行時間:{actual_run_time:.2f}秒",
-                    f"查詢失敗: {str(e)}, 錯誤碼: {e.args[0]}, 調用API: {from_where}, 查詢: {select_query}, 參數: {select_params}, 更新: {update_queries}, 參數: {update_params_list}"
+                    f"查詢失敗: {str(e)}, 錯誤碼: {e.args[0]}, 調用API: {from_where}, 查詢: {select_query}, 參數: {summarize_value(select_params)}, 更新: {summarize_value(update_queries)}, 參數: {summarize_value(update_params_list)}"
                 )
                 # 情境 A: 可重試的錯誤 (Deadlock 等)
                 if e.args[0] in error_codes_to_retry:
@@ -284,11 +1099,13 @@ async def mysql_exec(
                         exponential_base**retries
                     ) + random.uniform(0, retry_delay * 2)
                     total_wait_time += wait_time
-                    await logsys(
+                    log_lazy(
                         0,
                         def_name,
                         f"檢測到錯誤 {e.args[0]}。重試 {retries}/{max_retries} 次... 等待{wait_time:.2f}秒",
-                        f"調用API: {from_where}, 查詢: {select_query}, 參數: {select_params}, 更新: {update_queries}, 參數: {update_params_list}"
+                        "調用API: {from_where}, 查詢: {select_query}, 參數: {select_params}, 更新: {update_queries}, 參數: {update_params_list}",
+                        from_where=from_where, select_query=select_query, select_params=select_params,
+                        update_queries=update_queries, update_params_list=update_params_list,
                     )
                     if e.args[0] in {2006, 2013}:
                         # 連線斷了，無論是誰建立的，都需要清理舊的物件，因為下一輪會建立新的
@@ -298,7 +1115,7 @@ async def mysql_exec(
                         if conn:
                             # 這裡要小心：如果是外部傳入的conn斷了，我們 release 它；
                             # 下一輪我們會建立新的，這時候 created_new_connection 會在下一輪變成 True
-                            try: await mysql_pool.release(conn)
+                            try: await release_connection(mysql_pool, conn)
                             except Exception: pass
                         conn = None 
                         cur = None
@@ -315,7 +1132,7 @@ async def mysql_exec(
                         9,
                         def_name,
                         f"執行查詢或更新失敗 (不可重試): {str(e)}",
-                        f"調用API: {from_where}, 查詢: {select_query}, 參數: {select_params}, 更新: {update_queries}, 參數: {update_params_list}"
+                        f"調用API: {from_where}, 查詢: {select_query}, 參數: {summarize_value(select_params)}, 更新: {summarize_value(update_queries)}, 參數: {summarize_value(update_params_list)}"
                     )
                     # 只有當連線是我們自己建立的時候，我們才在報錯前釋放它
                     # 如果是外部傳入的，外部的 finally 會負責釋放
@@ -324,7 +1141,7 @@ async def mysql_exec(
                             try: await cur.close()
                             except Exception: pass
                         if conn:
-                            try: await mysql_pool.release(conn)
+                            try: await release_connection(mysql_pool, conn)
                             except Exception: pass
                     raise e
             else:
@@ -333,7 +1150,7 @@ async def mysql_exec(
                     9,
                     def_name,
                     f"未知錯誤: {str(e)}",
-                    f"調用API: {from_where}, 查詢: {select_query}, 參數: {select_params}, 更新: {update_queries}, 參數: {update_params_list}"
+                    f"調用API: {from_where}, 查詢: {select_query}, 參數: {summarize_value(select_params)}, 更新: {summarize_value(update_queries)}, 參數: {summarize_value(update_params_list)}"
                 )
                 # 同樣，只有我們建立的才釋放
                 if created_new_connection:
@@ -341,7 +1158,7 @@ async def mysql_exec(
                         try: await cur.close()
                         except Exception: pass
                     if conn:
-                        try: await mysql_pool.release(conn)
+                        try: await release_connection(mysql_pool, conn)
                         except Exception: pass
                 
                 raise e
@@ -354,14 +1171,139 @@ async def mysql_exec(
                         try: await cur.close()
                         except Exception: pass
                     if conn is not None:
-                        try: await mysql_pool.release(conn)
+                        try: await release_connection(mysql_pool, conn)
                         except Exception: pass
     # 退出循環 (達到最大重試次數或收到終止信號)，拋出異常
     raise Exception("達到最大重試次數或收到終止信號")
 
 
-# 重置連接狀態並釋放回連接池
+# 批次寫入：收集同一條 INSERT 在短時間內的多筆參數，合併成一次 executemany
+# 僅接受單純的 INSERT INTO ... VALUES (每筆成功即影響 1 行，可回傳各自的結果)；
+# 其他語句 (ON DUPLICATE KEY UPDATE、INSERT IGNORE、REPLACE 等) 直接逐筆執行
+INSERT_BATCHABLE_PATTERN = re.compile(r"^\s*INSERT\s+INTO\b.*\bVALUES\b", re.IGNORECASE | re.DOTALL)
+INSERT_NOT_BATCHABLE_PATTERN = re.compile(r"\bON\s+DUPLICATE\s+KEY\b", re.IGNORECASE)
+# 分組用：字串常數與識別字原樣保留，其餘連續空白視為一個空格
+INSERT_SHAPE_PATTERN = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`)|\s+")
+
+
+class InsertBatcher:
+    def __init__(self, window=INSERT_BATCH_WINDOW, max_rows=INSERT_BATCH_MAX_ROWS):
+        self.window = window
+        self.max_rows = max_rows
+        self.pending = {}  # 語句形狀 -> [(參數, future, 來源, 原始語句), ...]
+        self.timers = {}  # 語句形狀 -> 等待時間窗的任務
+        self.flush_tasks = set()  # 執行中的寫入任務 (保留參考避免被回收)
+        self.stats = {"批次數": 0, "筆數": 0}
+
+    def pending_count(self):
+        return sum(len(batch) for batch in self.pending.values())
+
+    # 送出一筆 INSERT，等待所屬批次寫入後回傳影響行數 (與單筆 mysql_exec 相同)
+    async def submit(self, from_where, update_query, update_params):
+        if not INSERT_BATCHABLE_PATTERN.match(update_query) or INSERT_NOT_BATCHABLE_PATTERN.search(update_query):
+            return await self.execute_single(from_where, update_query, update_params)
+
+        # 以語句形狀 (忽略常數以外的空白差異) 分組，執行時仍使用呼叫端的原始語句
+        key = INSERT_SHAPE_PATTERN.sub(lambda m: m.group(1) or " ", update_query).strip()
+        future = asyncio.get_running_loop().create_future()
+        batch = self.pending.setdefault(key, [])
+        batch.append((update_params, future, from_where, update_query))
+
+        if len(batch) >= self.max_rows:
+            timer = self.timers.pop(key, None)
+            if timer:
+                timer.cancel()
+            self.start_flush(key)
+        elif key not in self.timers:
+            self.timers[key] = asyncio.create_task(self.flush_later(key))
+        return await future
+
+    async def flush_later(self, key):
+        await asyncio.sleep(self.window)
+        self.timers.pop(key, None)
+        self.start_flush(key)
+
+    def start_flush(self, key):
+        task = asyncio.create_task(self.flush(key))
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    async def flush(self, key):
+        batch = self.pending.pop(key, None)
+        if not batch:
+            return
+        params_list = [params for params, _, _, _ in batch]
+        sources = sorted({from_where for _, _, from_where, _ in batch if from_where})
+        try:
+            # 以事務執行，整批成功或整批回滾，失敗時才能安全地改為逐筆重送
+            _, conn, cur = await mysql_exec(
+                from_where=f"InsertBatcher({len(batch)}筆): {', '.join(sources)}",
+                update_queries=batch[0][3],  # 同一形狀的語句只差在空白，以第一筆的原始語句執行
+                update_params_list=params_list,
+                lock=True,
+                use_executemany=True,
+            )
+        except Exception:
+            # 整批失敗並已回滾 (例如其中一筆違反唯一鍵)，逐筆執行讓每個呼叫端取得自己的結果或錯誤
+            await asyncio.gather(*(
+                self.resolve_single(future, from_where, update_query, params)
+                for params, future, from_where, update_query in batch
+            ))
+            return
+        # 已提交，之後的錯誤都不能再逐筆重送 (否則會重複寫入)
+        await self.release(conn, cur)
+
+        self.stats["批次數"] += 1
+        self.stats["筆數"] += len(batch)
+        for _, future, _, _ in batch:
+            if not future.done():
+                future.set_result(1)
+
+    async def resolve_single(self, future, from_where, update_query, update_params):
+        try:
+            result = await self.execute_single(from_where, update_query, update_params)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    async def execute_single(self, from_where, update_query, update_params):
+        result, conn, cur = await mysql_exec(
+            from_where=from_where,
+            update_queries=[update_query],
+            update_params_list=[update_params],
+        )
+        await self.release(conn, cur)
+        return result
+
+    # 歸還連線 (寫入已完成，歸還失敗只記錄日誌，不影響寫入結果)
+    async def release(self, conn, cur):
+        if cur is not None:
+            try: await cur.close()
+            except Exception: pass
+        try:
+            await reset_connection(conn)
+        except Exception as e:
+            await logsys(9, "InsertBatcher", "歸還連線失敗", str(e))
+
+    # 關閉前立即寫入所有尚未送出的批次
+    async def close(self):
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        await asyncio.gather(*(self.flush(key) for key in list(self.pending)), return_exceptions=True)
+        await asyncio.gather(*self.flush_tasks, return_exceptions=True)
+
+
+insert_batcher = InsertBatcher()
+
+
+# 重置連接狀態並釋放回連接池 (conn 為 None 表示結果來自快取，沒有借用連線)
 async def reset_connection(conn):
+    if conn is None:
+        return
     try:
         def_name = inspect.currentframe().f_code.co_name
     except Exception as e:
@@ -372,6 +1314,34 @@ async def reset_connection(conn):
     except Exception as e:  
         await logsys(9, def_name, "重置連線時出錯", str(e))  # 記錄日誌但不重新拋出異常。
     finally:
-        app.state.mysql.release(conn)  # 無論 autocommit 重置是否成功，都必須將連接釋放回連接池。
+        # 設回自動提交時會提交先前的寫入，讓提交前可能被快取的舊結果失效
+        pending_writes = getattr(conn, "_cache_pending_writes", None)
+        if pending_writes:
+            conn._cache_pending_writes = None
+            query_cache.invalidate_writes(pending_writes)
+        release_connection(app.state.mysql, conn)  # 無論 autocommit 重置是否成功，都必須將連接釋放回連接池。
+
+
+# -----------------------------------------------------------------------------
+# 監控端點 (Monitoring Endpoints)
+# -----------------------------------------------------------------------------
+
+# 連接池監控 (Prometheus 文字格式)
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        pool_metrics.render_prometheus(getattr(app.state, "mysql", None)),
+        media_type="text/plain; version=0.0.4",
+    )
 
 
+# 查詢效能彙總與慢查詢紀錄 (order_by: 總耗時、次數、最大耗時)
+@app.get("/admin/query_stats")
+async def query_stats(limit: int = 50, order_by: str = "總耗時"):
+    if order_by not in ("總耗時", "次數", "最大耗時"):
+        order_by = "總耗時"
+    return {
+        "慢查詢門檻秒數": SLOW_QUERY_THRESHOLD,
+        "查詢彙總": query_profiler.summary(limit=limit, order_by=order_by),
+        "慢查詢紀錄": list(query_profiler.slow_queries),
+    }
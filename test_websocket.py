@@ -1,13 +1,35 @@
-from typing import List
+import asyncio
+import glob
+import json
+import os
+import socket
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse
 
 """
 然後打開瀏覽器前往：http://localhost:8000 你就可以在網頁上輸入文字，並看到伺服器即時回應。
 執行: python -m uvicorn test_websocket:app --reload 
+多個 worker: WS_BROADCAST_BACKEND=unix python -m uvicorn test_websocket:app --workers 4
+    (跨機器則用 WS_BROADCAST_BACKEND=redis WS_REDIS_URL=redis://主機:6379/0，需安裝 redis 套件)
+連線存活檢查: 使用 uvicorn 的協定層 ping (--ws websockets，--ws-ping-interval 20 --ws-ping-timeout 20 為預設值)，用戶端不需要回應任何自訂訊息
 """
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 啟動廣播後端，其他 worker 發布的訊息交給本行程的 ConnectionManager 送出
+    await manager.backend.start(manager.dispatch)
+    print(f"廣播後端已啟動: {BROADCAST_BACKEND}")
+    try:
+        yield
+    finally:
+        await manager.backend.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # -------------------------
 # 1. 前端測試頁面 (HTML)
@@ -32,12 +54,19 @@ html = """
             var ws = new WebSocket("ws://localhost:8000/ws/" + clientId);
             
             // 當收到 Server 回傳訊息時
+            // 伺服器開啟合併模式時，以 "__batch__" 開頭的框架是多則訊息組成的 JSON 陣列
             ws.onmessage = function(event) {
                 var messages = document.getElementById('messages');
-                var message = document.createElement('li');
-                var content = document.createTextNode(event.data);
-                message.appendChild(content);
-                messages.appendChild(message);
+                var texts = [event.data];
+                if (event.data.startsWith("__batch__")) {
+                    texts = JSON.parse(event.data.slice("__batch__".length));
+                }
+                texts.forEach(function(text) {
+                    var message = document.createElement('li');
+                    var content = document.createTextNode(text);
+                    message.appendChild(content);
+                    messages.appendChild(message);
+                });
             };
 
             // 傳送訊息給 Server
@@ -60,29 +89,458 @@ html = """
 </html>
 """
 
+# --- 廣播設定 ---
+SEND_QUEUE_SIZE = 100  # 每條連線最多暫存的待送訊息數，超過代表該用戶端跟不上
+SLOW_CLIENT_POLICY = "disconnect"  # 待送佇列滿時: "drop" 丟棄該則訊息 / "disconnect" 中斷該連線
+SLOW_CLIENT_CLOSE_CODE = 1013  # 中斷慢速用戶端時的關閉碼 (Try Again Later)
+SEND_BUFFER_HIGH_WATER = 1_000_000  # 每條連線待送內容的字元數上限，超過視同跟不上 (避免少數大訊息佔滿記憶體)
+
+# 閒置設定：半開連線由 uvicorn 的協定層 ping/pong 偵測並關閉 (瀏覽器與一般 WebSocket 用戶端會自動回應)，
+# 這裡只限制用戶端多久沒有發送訊息，預設不限制，只接收不發送的用戶端也能保持連線
+CLIENT_IDLE_TIMEOUT = float(os.environ.get("WS_CLIENT_IDLE_TIMEOUT", "0"))  # 超過此秒數沒有收到訊息就中斷，0 為不限制
+IDLE_CLOSE_CODE = 1001  # Going Away
+
+# 上傳速率限制 (每條連線的 token bucket)
+RATE_LIMIT_PER_SECOND = 10  # 每秒可發送的訊息數
+RATE_LIMIT_BURST = 20  # 短時間內最多可連續發送的訊息數
+RATE_LIMIT_MAX_VIOLATIONS = 50  # 持續超速被略過的訊息超過此數就中斷 (額度回滿時歸零)
+RATE_LIMIT_CLOSE_CODE = 1008  # Policy Violation
+
+
+# 多 worker 廣播後端: "memory" 單一行程 (預設) / "unix" 同一台機器的 worker / "redis" 跨機器 (Redis 相容服務)
+BROADCAST_BACKEND = os.environ.get("WS_BROADCAST_BACKEND", "memory")
+WS_UNIX_SOCKET_DIR = os.environ.get("WS_UNIX_SOCKET_DIR", "/tmp/test_websocket")  # 各 worker 的 socket 放在此目錄
+WS_UNIX_MAX_DATAGRAM = 65536  # 單則訊息上限 (位元組)，超過的不轉送給其他 worker 並計入丟棄
+WS_UNIX_PEER_REFRESH = 5  # 每隔幾秒重新掃描目錄內的 worker (送出失敗時也會重新掃描)
+WS_REDIS_RECONNECT_MAX_DELAY = 30  # Redis 斷線後重新連線的最長等待秒數 (從 1 秒起倍增)
+WS_REDIS_URL = os.environ.get("WS_REDIS_URL", "redis://localhost:6379/0")
+WS_REDIS_CHANNEL = os.environ.get("WS_REDIS_CHANNEL", "test_websocket")
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"  # 用來略過自己發布的訊息
+
+# 訊息合併設定：時間窗內要送出的訊息，每個接收者合併成一個框架 (COALESCE_BATCH_PREFIX 加 JSON 陣列)，訊息密集時大幅減少框架數
+COALESCE_WINDOW = float(os.environ.get("WS_COALESCE_WINDOW", "0"))  # 合併時間窗 (秒)，0 為關閉，建議 0.005~0.02
+COALESCE_MAX_MESSAGES = int(os.environ.get("WS_COALESCE_MAX_MESSAGES", "50"))  # 累積到此則數立即送出
+COALESCE_BATCH_PREFIX = "__batch__"  # 合併框架的開頭，後接 JSON 陣列 (前端測試頁面只拆開這種框架)
+
+
+# --- 廣播後端 ---
+# 訊息格式: {"origin": WORKER_ID, "kind": "broadcast"/"publish"/"personal", "rooms": [...], "client_id": id, "text": 內容}
+# publish 時本行程直接處理，再送給其他 worker，各 worker 只送給自己持有的連線
+class MemoryBackend:
+    """單一行程：直接交給本行程的 ConnectionManager"""
+
+    distributed = False
+
+    async def start(self, on_message):
+        self.on_message = on_message
+
+    async def publish(self, event: dict):
+        self.on_message(event)
+
+    async def stop(self):
+        pass
+
+
+class UnixSocketBackend:
+    """同一台機器的多個 worker：各自在共用目錄綁定一個 Unix datagram socket，發布時送給目錄內其他 socket"""
+
+    distributed = True
+
+    def __init__(self, directory: str = WS_UNIX_SOCKET_DIR):
+        self.directory = directory
+        self.path = os.path.join(directory, f"worker-{os.getpid()}.sock")
+        self.dropped = 0  # 對方接收緩衝區已滿或訊息過大而丟棄的次數
+        self.peers: List[str] = []  # 其他 worker 的 socket 路徑 (定期重新掃描，不在每則訊息都掃描目錄)
+        self.peers_at = 0.0
+
+    async def start(self, on_message):
+        self.on_message = on_message
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # 同 pid 遺留的舊檔
+        self.receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.receiver.bind(self.path)
+        self.receiver.setblocking(False)
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.receiver.fileno(), self.on_readable)
+
+    def on_readable(self):
+        while True:
+            try:
+                data = self.receiver.recv(WS_UNIX_MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                self.on_message(json.loads(data))
+            except Exception as e:
+                print("廣播後端", "處理訊息失敗", str(e))
+
+    def refresh_peers(self):
+        self.peers = [
+            peer for peer in glob.glob(os.path.join(self.directory, "worker-*.sock")) if peer != self.path
+        ]
+        self.peers_at = time.monotonic()
+
+    async def publish(self, event: dict):
+        self.on_message(event)
+        data = json.dumps(event).encode("utf-8")
+        if len(data) > WS_UNIX_MAX_DATAGRAM:
+            # 超過接收端的讀取上限會被截斷，不轉送
+            self.dropped += 1
+            print("廣播後端", f"訊息 {len(data)} 位元組超過上限 {WS_UNIX_MAX_DATAGRAM}，未轉送給其他 worker")
+            return
+        if time.monotonic() - self.peers_at > WS_UNIX_PEER_REFRESH:
+            self.refresh_peers()
+        for peer in list(self.peers):
+            try:
+                self.sender.sendto(data, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 該 worker 已經結束，清掉遺留的 socket 檔，下次送出前重新掃描
+                self.peers.remove(peer)
+                self.peers_at = 0.0
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+            except OSError:
+                self.dropped += 1
+
+    async def stop(self):
+        asyncio.get_running_loop().remove_reader(self.receiver.fileno())
+        self.receiver.close()
+        self.sender.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class RedisBackend:
+    """跨機器的多個 worker：透過 Redis (或相容服務) 的 Pub/Sub 頻道轉送"""
+
+    distributed = True
+
+    def __init__(self, url: str = WS_REDIS_URL, channel: str = WS_REDIS_CHANNEL):
+        self.url = url
+        self.channel = channel
+        self.pubsub = None
+        self.dropped = 0  # Redis 無法連線時未轉送的訊息數
+
+    async def start(self, on_message):
+        import redis.asyncio as redis  # 選用套件，只有使用 redis 後端時才需要安裝
+
+        self.on_message = on_message
+        self.client = redis.from_url(self.url)
+        await self.subscribe()  # 啟動時就確認可以連線
+        self.listener_task = asyncio.create_task(self.listener())
+
+    async def subscribe(self):
+        self.pubsub = self.client.pubsub()
+        await self.pubsub.subscribe(self.channel)
+
+    @staticmethod
+    async def close_quietly(resource):
+        # redis 5 以後改名為 aclose()
+        try:
+            close = getattr(resource, "aclose", None) or resource.close
+            await close()
+        except Exception:
+            pass
+
+    # 接收其他 worker 的訊息；連線中斷時記錄並重新訂閱，不讓跨 worker 廣播悄悄停止
+    async def listener(self):
+        delay = 1
+        while True:
+            try:
+                if self.pubsub is None:
+                    await self.subscribe()
+                    print("廣播後端", "Redis 已重新訂閱")
+                async for message in self.pubsub.listen():
+                    delay = 1
+                    if message["type"] != "message":
+                        continue
+                    try:
+                        event = json.loads(message["data"])
+                        if event["origin"] != WORKER_ID:  # 自己發布的已經在 publish 時處理過
+                            self.on_message(event)
+                    except Exception as e:
+                        print("廣播後端", "處理訊息失敗", str(e))
+                raise ConnectionError("訂閱已結束")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("廣播後端", f"Redis 訂閱中斷，{delay} 秒後重新連線", str(e))
+                if self.pubsub is not None:
+                    await self.close_quietly(self.pubsub)
+                    self.pubsub = None
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, WS_REDIS_RECONNECT_MAX_DELAY)
+
+    async def publish(self, event: dict):
+        self.on_message(event)
+        try:
+            await self.client.publish(self.channel, json.dumps(event))
+        except Exception as e:
+            # Redis 暫時無法連線：本 worker 的用戶端已收到，其他 worker 的這則訊息遺失
+            self.dropped += 1
+            print("廣播後端", "轉送到 Redis 失敗", str(e))
+
+    async def stop(self):
+        self.listener_task.cancel()
+        await asyncio.gather(self.listener_task, return_exceptions=True)
+        if self.pubsub is not None:
+            await self.close_quietly(self.pubsub)
+        await self.close_quietly(self.client)
+
+
+BROADCAST_BACKENDS = {"memory": MemoryBackend, "unix": UnixSocketBackend, "redis": RedisBackend}
+
+
+# --- 單一連線 ---
+class ClientConnection:
+    """每條連線有自己的待送佇列與寫出任務，慢的用戶端只會塞住自己的佇列"""
+
+    def __init__(self, client_id: int, websocket: WebSocket):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.rooms: Set[str] = set()  # 已訂閱的聊天室，斷線時據此退出
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.closed = False
+        self.dropped = 0  # 因佇列已滿而丟棄的訊息數
+        self.queued_chars = 0  # 佇列中待送內容的字元數
+        self.tokens = float(RATE_LIMIT_BURST)  # 上傳速率限制的剩餘額度
+        self.tokens_at = time.monotonic()
+        self.violations = 0  # 這一波超速被略過的訊息數
+        self.writer_task = asyncio.create_task(self.writer())
+
+    async def writer(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                await self.websocket.send(frame)
+                self.queued_chars -= len(frame["text"])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # 送出失敗代表連線已中斷，由 ConnectionManager 在下次送出時移除
+            self.closed = True
+
+    def enqueue(self, frame: dict) -> bool:
+        # 不等待，佇列滿了或待送內容超過上限直接回報失敗
+        size = len(frame["text"])
+        if self.queued_chars + size > SEND_BUFFER_HIGH_WATER:
+            self.dropped += 1
+            return False
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.queued_chars += size
+        return True
+
+    def allow(self) -> bool:
+        # token bucket：依經過時間補回額度，額度不足的訊息略過
+        now = time.monotonic()
+        self.tokens = min(RATE_LIMIT_BURST, self.tokens + (now - self.tokens_at) * RATE_LIMIT_PER_SECOND)
+        self.tokens_at = now
+        if self.tokens >= RATE_LIMIT_BURST:
+            # 額度已回滿表示已停止超速，長時間連線不會因累積的零星超速被中斷
+            self.violations = 0
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.violations += 1
+        return False
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        self.writer_task.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # 連線可能已經斷了
+
+
 # --- 連線管理器 ---
 class ConnectionManager:
-    def __init__(self):
-        # 這裡用一個 List 存所有連上來的 user
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, backend=None):
+        # 廣播後端 (多 worker 時負責把訊息轉送給其他 worker)
+        self.backend = backend or MemoryBackend()
+        # 以 client_id 為鍵值，連線、斷線、私訊查找都是 O(1)
+        self.active_connections: Dict[int, ClientConnection] = {}
+        # 聊天室名稱 -> 訂閱者 client_id
+        self.rooms: Dict[str, Set[int]] = {}
+        # 合併模式下等待送出的訊息: (接收者 client_id，None 表示所有人, 內容)
+        self.pending: List[Tuple[Optional[Set[int]], str]] = []
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.close_tasks: Set[asyncio.Task] = set()  # 背景關閉中的連線 (保留參考避免被回收)
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, client_id: int) -> ClientConnection:
         await websocket.accept()
-        self.active_connections.append(websocket)
+        # 同一個 client_id 重複連線時，中斷舊的連線，新連線沿用舊連線的聊天室
+        old = self.active_connections.get(client_id)
+        if old is not None:
+            self.remove(old)
+            self.close_later(old, 1000)
+        connection = self.active_connections[client_id] = ClientConnection(client_id, websocket)
+        if old is not None:
+            for room in old.rooms:
+                self.subscribe(client_id, room)
+        return connection
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+    async def receive(self, connection: ClientConnection) -> str:
+        # 接收下一則訊息：處理閒置逾時與速率限制，需要中斷時拋出 WebSocketDisconnect
+        while True:
+            if connection.closed:
+                raise WebSocketDisconnect(SLOW_CLIENT_CLOSE_CODE)
+            try:
+                data = await asyncio.wait_for(connection.websocket.receive_text(), CLIENT_IDLE_TIMEOUT or None)
+            except asyncio.TimeoutError:
+                self.evict(connection, IDLE_CLOSE_CODE, f"超過 {CLIENT_IDLE_TIMEOUT} 秒沒有回應")
+                raise WebSocketDisconnect(IDLE_CLOSE_CODE)
+            if connection.allow():
+                return data
+            if connection.violations > RATE_LIMIT_MAX_VIOLATIONS:
+                self.evict(connection, RATE_LIMIT_CLOSE_CODE, f"發送過於頻繁 (超速 {connection.violations} 則)")
+                raise WebSocketDisconnect(RATE_LIMIT_CLOSE_CODE)
+            self.deliver(connection, {"type": "websocket.send", "text": "發送過於頻繁，訊息已略過"})
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        # 傳給特定的人
-        await websocket.send_text(message)
+    def remove(self, connection: ClientConnection):
+        # 只移除同一條連線 (可能已被同 client_id 的新連線取代或已被中斷)
+        if self.active_connections.get(connection.client_id) is connection:
+            del self.active_connections[connection.client_id]
+            for room in connection.rooms:
+                self.discard_member(room, connection.client_id)
+        connection.closed = True
+        connection.writer_task.cancel()
+
+    def disconnect(self, client_id: int, websocket: WebSocket):
+        connection = self.active_connections.get(client_id)
+        if connection is not None and connection.websocket is websocket:
+            self.remove(connection)
+
+    # --- 聊天室 (Rooms) ---
+    def subscribe(self, client_id: int, room: str):
+        connection = self.active_connections.get(client_id)
+        if connection is not None:
+            self.rooms.setdefault(room, set()).add(client_id)
+            connection.rooms.add(room)
+
+    def unsubscribe(self, client_id: int, room: str):
+        connection = self.active_connections.get(client_id)
+        if connection is not None:
+            connection.rooms.discard(room)
+        self.discard_member(room, client_id)
+
+    def discard_member(self, room: str, client_id: int):
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(client_id)
+            if not members:
+                del self.rooms[room]  # 沒人的聊天室直接移除
+
+    # --- 送出 (Delivery) ---
+    def close_later(self, connection: ClientConnection, code: int):
+        task = asyncio.create_task(connection.close(code))
+        self.close_tasks.add(task)
+        task.add_done_callback(self.close_tasks.discard)
+
+    def evict(self, connection: ClientConnection, code: int, reason: str):
+        # 中斷失效或違規的用戶端，關閉動作放到背景，不讓廣播等待
+        self.remove(connection)
+        self.close_later(connection, code)
+        print(f"Client #{connection.client_id} {reason}，已中斷連線")
+
+    def deliver(self, connection: ClientConnection, frame: dict):
+        if connection.closed:
+            self.remove(connection)
+        elif not connection.enqueue(frame) and SLOW_CLIENT_POLICY == "disconnect":
+            self.evict(connection, SLOW_CLIENT_CLOSE_CODE, f"待送內容超過上限 ({SEND_QUEUE_SIZE} 則或 {SEND_BUFFER_HIGH_WATER} 字元)")
+
+    def deliver_to(self, client_ids: Iterable[int], frame: dict):
+        # 先複製成 list，送出過程中可能有連線被移除
+        for client_id in list(client_ids):
+            connection = self.active_connections.get(client_id)
+            if connection is not None:
+                self.deliver(connection, frame)
+
+    # 處理廣播後端送來的訊息 (包含本行程發布的)，只送給本行程持有的連線
+    def dispatch(self, event: dict):
+        if event["kind"] == "personal":
+            if event["client_id"] in self.active_connections:
+                self.route({event["client_id"]}, event["text"])
+        elif event["kind"] == "publish":
+            # 同時在多個聊天室的人只收到一次
+            recipients: Set[int] = set()
+            for room in event["rooms"]:
+                recipients |= self.rooms.get(room, set())
+            self.route(recipients, event["text"])
+        else:
+            self.route(None, event["text"])
+
+    # 送出訊息：未開啟合併時立即放入佇列，開啟時先累積，時間窗結束或達到則數上限再送出
+    def route(self, recipients: Optional[Set[int]], text: str):
+        if COALESCE_WINDOW <= 0:
+            # 訊息框架只建立一次，放進每條連線的佇列後立即返回，由各自的寫出任務送出
+            frame = {"type": "websocket.send", "text": self.pack([text])}
+            self.deliver_to(self.active_connections if recipients is None else recipients, frame)
+            return
+        self.pending.append((recipients, text))
+        if len(self.pending) >= COALESCE_MAX_MESSAGES:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(COALESCE_WINDOW, self.flush)
+
+    @staticmethod
+    def pack(texts: List[str]) -> str:
+        # 單則訊息原樣送出；多則 (或本身就以標記開頭，避免被誤拆) 才加上標記並編成 JSON 陣列
+        if len(texts) == 1 and not texts[0].startswith(COALESCE_BATCH_PREFIX):
+            return texts[0]
+        return COALESCE_BATCH_PREFIX + json.dumps(texts, ensure_ascii=False)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        pending, self.pending = self.pending, []
+        # 每個接收者要收到哪幾則訊息 (依發布順序)
+        indices_of: Dict[int, List[int]] = {}
+        for index, (recipients, _) in enumerate(pending):
+            for client_id in self.active_connections if recipients is None else recipients:
+                indices_of.setdefault(client_id, []).append(index)
+        # 收到相同訊息組合的接收者共用同一個框架 (全體廣播時只會建立一個)
+        frames: Dict[Tuple[int, ...], dict] = {}
+        for client_id, indices in indices_of.items():
+            key = tuple(indices)
+            frame = frames.get(key)
+            if frame is None:
+                text = self.pack([pending[index][1] for index in indices])
+                frame = frames[key] = {"type": "websocket.send", "text": text}
+            connection = self.active_connections.get(client_id)
+            if connection is not None:
+                self.deliver(connection, frame)
+
+    async def send_personal_message(self, message: str, client_id: int) -> Optional[bool]:
+        # 傳給特定的人，回傳對方是否在線 (多 worker 時對方可能在其他 worker，無法得知則回傳 None)
+        if client_id in self.active_connections:
+            self.route({client_id}, message)
+            return True
+        if not self.backend.distributed:
+            return False
+        await self.backend.publish({"origin": WORKER_ID, "kind": "personal", "client_id": client_id, "text": message})
+        return None
+
+    async def publish(self, rooms: Iterable[str], message: str):
+        # 傳給聊天室的訂閱者 (所有 worker)
+        await self.backend.publish({"origin": WORKER_ID, "kind": "publish", "rooms": list(rooms), "text": message})
 
     async def broadcast(self, message: str):
-        # 廣播給所有人
-        for connection in self.active_connections:
-            await connection.send_text(message)
+        # 廣播給所有人 (所有 worker)
+        await self.backend.publish({"origin": WORKER_ID, "kind": "broadcast", "text": message})
 
-manager = ConnectionManager()
+manager = ConnectionManager(BROADCAST_BACKENDS[BROADCAST_BACKEND]())
 
 # --- 根路由：返回 HTML 頁面 ---
 @app.get("/")
@@ -90,18 +548,45 @@ async def get():
     return HTMLResponse(html)
 
 # --- 修改後的 Endpoint ---
+# 聊天指令: "/join 名稱" 加入聊天室、"/leave 名稱" 離開聊天室、"/msg 對方id 內容" 私訊
+# 其他文字發送到自己所在的所有聊天室 (連線時可用 ?room=名稱 指定，預設為大廳)
+DEFAULT_ROOM = "大廳"
+
+
 @app.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: int):
-    # 連線時加入名單
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, client_id: int, room: str = DEFAULT_ROOM):
+    # 連線時加入名單與聊天室
+    connection = await manager.connect(websocket, client_id)
+    manager.subscribe(client_id, room)
     try:
         while True:
-            data = await websocket.receive_text()
-            # 收到某人的訊息，廣播給所有人：「Client #1 說：Hello」
-            await manager.broadcast(f"Client #{client_id} 說: {data}")
-            print(f"Client #{client_id} 說: {data}")
+            # 由管理器處理心跳、閒置逾時與速率限制
+            data = await manager.receive(connection)
+            command, _, argument = data.partition(" ")
+            if command == "/join" and argument:
+                manager.subscribe(client_id, argument)
+                await manager.publish([argument], f"Client #{client_id} 加入了 {argument}")
+            elif command == "/leave" and argument:
+                await manager.publish([argument], f"Client #{client_id} 離開了 {argument}")
+                manager.unsubscribe(client_id, argument)
+            elif command == "/msg" and argument:
+                target, _, text = argument.partition(" ")
+                if not target.isdigit() or await manager.send_personal_message(
+                    f"Client #{client_id} 私訊: {text}", int(target)
+                ) is False:
+                    await manager.send_personal_message(f"Client #{target} 不在線上", client_id)
+            else:
+                # 收到某人的訊息，發送給同聊天室的人：「Client #1 說：Hello」
+                await manager.publish(connection.rooms, f"Client #{client_id} 說: {data}")
+                print(f"Client #{client_id} 說: {data}")
     except WebSocketDisconnect:
-        # 斷線時移除名單，並通知其他人
-        manager.disconnect(websocket)
-        await manager.broadcast(f"Client #{client_id} 離開了聊天室")
-        print(f"Client #{client_id} 離開了聊天室")
\ No newline at end of file
+        # 斷線時移除名單，並通知同聊天室的人
+        # (被管理器中斷的連線已移出名單，聊天室改由連線本身記錄)
+        rooms = set(connection.rooms)
+        current = manager.active_connections.get(client_id)
+        manager.disconnect(client_id, websocket)
+        # 同一個 client_id 已重新連線 (這條連線被取代)，對方仍在線上，不通知離開
+        if current is not None and current is not connection:
+            return
+        await manager.publish(rooms, f"Client #{client_id} 離開了聊天室")
+        print(f"Client #{client_id} 離開了聊天室")
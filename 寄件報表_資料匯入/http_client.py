@@ -0,0 +1,73 @@
+"""
+寄件報表程式與資料匯入程式共用的 HTTP 連線設定
+統一建立 aiohttp.ClientSession，讓同時對多個商城連線時能重複使用已建立的 TLS 連線
+"""
+import aiohttp
+
+# ==========================================
+# 1. 連線池設定 (Configuration)
+# ==========================================
+CONNECTION_LIMIT = 100  # 全部商城合計的連線上限
+CONNECTION_LIMIT_PER_HOST = 10  # 單一商城的連線上限 (需不小於程式內的同時下載/匯入上限)
+DNS_CACHE_TTL = 600  # DNS 查詢結果快取秒數 (商城網域不常變動)
+KEEPALIVE_TIMEOUT = 60  # 閒置連線保留秒數，期間內再次請求同一商城可免去重新握手
+
+
+# ==========================================
+# 2. 連線統計 (Connection Stats)
+# ==========================================
+class ConnectionStats:
+    """透過 aiohttp TraceConfig 統計新建連線與重複使用連線的次數"""
+
+    def __init__(self):
+        self.requests = 0  # 發出的請求數
+        self.created = 0  # 新建立的連線數 (每次都要 DNS + TCP + TLS 握手)
+        self.reused = 0  # 重複使用的連線數
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """建立掛在 session 上的 TraceConfig"""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self.requests += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self.created += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.reused += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def report(self):
+        """顯示連線使用統計"""
+        total = self.created + self.reused
+        reuse_rate = self.reused / total * 100 if total else 0
+        print(f"[連線統計] 請求 {self.requests} 次，新建連線 {self.created} 條，"
+              f"重複使用 {self.reused} 次 (重複使用率 {reuse_rate:.1f}%)")
+
+
+# ==========================================
+# 3. Session 工廠 (Session Factory)
+# ==========================================
+def create_session(stats: ConnectionStats = None,
+                   limit: int = CONNECTION_LIMIT,
+                   limit_per_host: int = CONNECTION_LIMIT_PER_HOST,
+                   ttl_dns_cache: int = DNS_CACHE_TTL,
+                   keepalive_timeout: float = KEEPALIVE_TIMEOUT) -> aiohttp.ClientSession:
+    """
+    建立共用的 ClientSession
+    stats: 傳入 ConnectionStats 時會記錄連線使用狀況，程式結束時可呼叫 stats.report()
+    """
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=ttl_dns_cache,
+        use_dns_cache=True,
+        keepalive_timeout=keepalive_timeout,
+    )
+    trace_configs = [stats.trace_config()] if stats is not None else None
+    return aiohttp.ClientSession(connector=connector, trace_configs=trace_configs)
@@ -1,8 +1,12 @@
+import argparse
 import asyncio
+import json
 import os
 import sys
 import aiohttp  # 現代 Python 網頁請求標準庫 (需 pip install aiohttp)
-from datetime import datetime
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from http_client import ConnectionStats, create_session
 
 # 設置行緩衝
 sys.stdout = os.fdopen(sys.stdout.fileno(), "w", 1)
@@ -36,11 +40,11 @@ def load_domains(filename='domain.txt'):
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 domains = [line.strip() for line in f if line.strip()]
-            print(f"[系統] 已從 {filename} 載入 {len(domains)} 個網域。")
+            print(f"[系統] 已從 {filename} 載入 {len(domains)} 個網域。", file=sys.stderr)
         except Exception as e:
-            print(f"[錯誤] 讀取網域設定檔失敗: {e}")
+            print(f"[錯誤] 讀取網域設定檔失敗: {e}", file=sys.stderr)
     else:
-        print(f"[警告] 找不到 {file_path}，請確保檔案存在。")
+        print(f"[警告] 找不到 {file_path}，請確保檔案存在。", file=sys.stderr)
     return domains
 
 # 初始化載入
@@ -49,6 +53,18 @@ HOST_API_LIST = load_domains()
 # API 密鑰與參數
 E5_PASSWD = '2d6um@fZ.?=Q8qF7SS6seaW?QP3d!?!T'
 
+# 下載時每次寫入的區塊大小 (位元組)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# 報表快取資訊檔 (記錄 ETag / Last-Modified / 檔案大小，用於條件式請求與續傳)
+REPORT_CACHE_FILE = os.path.join(SCRIPT_DIR, 'report_cache.json')
+
+# 全部商城/多日期模式的同時下載上限 (避免一次對所有商城開太多連線)
+DOWNLOAD_CONCURRENCY = 5
+
+# 日期輸入提示 (支援單日、範圍 0-6 與逗號列表 1,3,5)
+DATE_PROMPT = '請輸入您欲匯出的日期 (今天不輸入，前一天1，前兩天2，範圍如 0-6 或 1,3,5): '
+
 # ==========================================
 # 2. 工具函式 (Utilities)
 # ==========================================
@@ -64,6 +80,113 @@ async def get_input(prompt: str) -> str:
     """
     return await asyncio.get_event_loop().run_in_executor(None, input, prompt)
 
+
+def load_report_cache() -> dict:
+    """載入報表快取資訊，檔案不存在或損毀時回傳空字典"""
+    if not os.path.exists(REPORT_CACHE_FILE):
+        return {}
+    try:
+        with open(REPORT_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except Exception as e:
+        print(f"[警告] 讀取報表快取失敗，將重新下載: {e}", file=sys.stderr)
+        return {}
+
+
+def save_report_cache():
+    """寫回報表快取資訊 (先寫暫存檔再改名，避免寫到一半損毀)"""
+    temp_file = f'{REPORT_CACHE_FILE}.tmp'
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(REPORT_CACHE, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, REPORT_CACHE_FILE)
+    except Exception as e:
+        print(f"[警告] 寫入報表快取失敗: {e}")
+
+
+def report_cache_key(domain: str, e5_date: str) -> str:
+    """快取鍵值: (網域, 日期)"""
+    return f'{domain}|{e5_date}'
+
+
+def is_cached_file_intact(entry: dict, filename: str) -> bool:
+    """確認本地檔案仍是快取記錄的那一份 (大小與修改時間皆相符)"""
+    if not entry.get('complete') or entry.get('filename') != filename:
+        return False
+    if not os.path.exists(filename):
+        return False
+    return (os.path.getsize(filename) == entry.get('length')
+            and os.path.getmtime(filename) == entry.get('mtime'))
+
+
+
+def is_cached_part_intact(entry: dict, filename: str, temp_filename: str) -> bool:
+    """確認暫存檔是這筆快取中斷時留下的那一份，才可以續傳"""
+    if entry.get('complete') or entry.get('filename') != filename:
+        return False
+    # 壓縮傳輸時暫存檔是解壓後的內容，與 Range 的位元組位置對不上 (舊版快取沒有此欄位，一併視為不可續傳)
+    if entry.get('encoded', True):
+        return False
+    if not os.path.exists(temp_filename):
+        return False
+    return (os.path.getsize(temp_filename) == entry.get('partial_length')
+            and os.path.getmtime(temp_filename) == entry.get('partial_mtime'))
+
+
+def discard_partial(cache_key: str, temp_filename: str):
+    """刪除無法續傳的暫存檔與對應的快取紀錄，下次改為完整下載"""
+    if os.path.exists(temp_filename):
+        os.remove(temp_filename)
+    if REPORT_CACHE.pop(cache_key, None) is not None:
+        save_report_cache()
+
+
+def parse_date_offsets(text: str) -> list:
+    """
+    解析日期輸入，回傳 e5_date 列表 (保持輸入順序、去除重複)
+    空白或 0 代表今天 (送出空字串，與單日模式相同)
+    例: '' -> [''], '0-2' -> ['', '1', '2'], '1,3' -> ['1', '3']
+    格式錯誤時拋出 ValueError
+    """
+    text = text.strip()
+    if not text:
+        return ['']
+
+    offsets = []
+    for part in text.split(','):
+        part = part.strip()
+        if '-' in part:
+            start_str, end_str = (p.strip() for p in part.split('-', 1))
+            if not (start_str.isdigit() and end_str.isdigit()):
+                raise ValueError(f"日期範圍格式錯誤: {part}")
+            start, end = int(start_str), int(end_str)
+            if start > end:
+                start, end = end, start
+            offsets.extend(range(start, end + 1))
+        elif part.isdigit():
+            offsets.append(int(part))
+        else:
+            raise ValueError(f"日期格式錯誤: {part}")
+
+    e5_dates = []
+    for offset in offsets:
+        e5_date = str(offset) if offset else ''
+        if e5_date not in e5_dates:
+            e5_dates.append(e5_date)
+    return e5_dates
+
+
+def report_filename(domain: str, e5_date: str, with_date: bool = False) -> str:
+    """報表檔名；多日期模式加上實際日期 (YYYYMMDD) 以免互相覆蓋"""
+    if not with_date:
+        return f'寄件報表-{domain}.xls'
+    report_date = datetime.now() - timedelta(days=int(e5_date or 0))
+    return f'寄件報表-{domain}-{report_date:%Y%m%d}.xls'
+
+# 初始化載入報表快取
+REPORT_CACHE = load_report_cache()
+
 # ==========================================
 # 3. 核心邏輯 (Core Logic)
 # ==========================================
@@ -75,13 +198,16 @@ def show_menu():
     print('-' * 30)
     for index, domain in enumerate(HOST_API_LIST):
         print(f"{index + 1}. 取得資料: {domain}")
+    print(f"{len(HOST_API_LIST) + 1}. 取得資料: 全部商城")
     print("0. 結 束 程 式")
     print('-' * 30)
 
 
-async def download_report(session: aiohttp.ClientSession, select_mall_idx: int, e5_date: str) -> bool:
+async def download_report(session: aiohttp.ClientSession, select_mall_idx: int, e5_date: str,
+                          with_date: bool = False) -> bool:
     """
     執行下載報表的任務
+    with_date: 檔名是否加上日期 (多日期模式)
     回傳: True (成功), False (失敗)
     """
     try:
@@ -94,36 +220,172 @@ async def download_report(session: aiohttp.ClientSession, select_mall_idx: int,
             'e5_date': e5_date
         }
 
+        filename = report_filename(domain, e5_date, with_date)
+        # 先寫入暫存檔，完整下載後才改名，避免中斷時留下不完整的報表
+        temp_filename = f'{filename}.part'
+
+        # 依快取決定請求方式：條件式請求 (未變更回 304) 或從暫存檔續傳 (Range)
+        cache_key = report_cache_key(domain, e5_date)
+        entry = REPORT_CACHE.get(cache_key, {})
+        # 要求不壓縮，寫入的位元組才與 Range / Content-Length 的位置一致
+        headers = {'Accept-Encoding': 'identity'}
+        resume_from = 0
+        if is_cached_file_intact(entry, filename):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        elif is_cached_part_intact(entry, filename, temp_filename):
+            # 弱 ETag 不能用於 If-Range，改用 Last-Modified
+            validator = entry.get('etag') if not str(entry.get('etag', '')).startswith('W/') else None
+            validator = validator or entry.get('last_modified')
+            if validator:
+                resume_from = os.path.getsize(temp_filename)
+                headers['Range'] = f'bytes={resume_from}-'
+                headers['If-Range'] = validator
+
         print(f"[系統] 正在連線至: {domain} ...")
         
         # 使用 aiohttp 發送非同步 GET 請求
-        async with session.get(url, params=params, timeout=30) as response:
-            if response.status != 200:
-                print(f"[錯誤] HTTP 狀態碼異常: {response.status}")
-                return False
-
-            # 讀取內容
-            content = await response.read()
-            filename = f'寄件報表-{domain}.xls'
-
-            # 寫入檔案
-            with open(filename, mode='wb') as f:
-                f.write(content)
+        while True:
+            async with session.get(url, params=params, headers=headers, timeout=30) as response:
+                if 'Range' in headers and response.status not in (200, 206):
+                    # 續傳失敗 (例如 416)：清除暫存檔與快取，改為完整下載
+                    print(f"[系統] {domain} 無法續傳 (HTTP {response.status})，改為完整下載")
+                    discard_partial(cache_key, temp_filename)
+                    headers = {'Accept-Encoding': 'identity'}
+                    resume_from = 0
+                    continue
+
+                if response.status == 304:
+                    print(f"[成功] 報表未變更，沿用本地檔案: {filename}")
+                    return True
+
+                if response.status == 206 and 'Range' in headers:
+                    print(f"[系統] {domain} 從第 {resume_from} 位元組續傳")
+                    file_mode = 'ab'
+                elif response.status == 200:
+                    # 伺服器回傳完整內容 (不支援續傳或檔案已變更)，從頭寫入
+                    resume_from = 0
+                    file_mode = 'wb'
+                else:
+                    print(f"[錯誤] {domain} HTTP 狀態碼異常: {response.status}")
+                    return False
+
+                # 記錄本次回應的驗證資訊，供下次條件式請求或續傳使用
+                encoded = response.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+                entry = {
+                    'filename': filename,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    # 伺服器有壓縮傳輸時 Content-Length 不是檔案大小，無法用來核對
+                    'length': (response.content_length + resume_from
+                               if response.content_length is not None
+                               and not encoded else None),
+                    'encoded': encoded,
+                    'complete': False,
+                }
+                REPORT_CACHE[cache_key] = entry
+                save_report_cache()
+
+                try:
+                    # 分段串流寫入，記憶體用量不隨報表大小增加
+                    with open(temp_filename, mode=file_mode) as f:
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                    if entry['length'] is not None and os.path.getsize(temp_filename) != entry['length']:
+                        raise aiohttp.ClientPayloadError(
+                            f"檔案大小不符 (預期 {entry['length']}，實際 {os.path.getsize(temp_filename)})")
+                    os.replace(temp_filename, filename)
+                except BaseException:
+                    # 傳輸中斷 (含取消)：有驗證資訊時保留暫存檔供下次續傳，否則清除
+                    if os.path.exists(temp_filename):
+                        part_size = os.path.getsize(temp_filename)
+                        resumable = not encoded and (entry['length'] is None or part_size < entry['length'])
+                        if resumable and (entry['etag'] or entry['last_modified']):
+                            entry['partial_length'] = part_size
+                            entry['partial_mtime'] = os.path.getmtime(temp_filename)
+                            save_report_cache()
+                        else:
+                            os.remove(temp_filename)
+                    raise
+
+                entry['complete'] = True
+                entry['length'] = os.path.getsize(filename)
+                entry['mtime'] = os.path.getmtime(filename)
+                save_report_cache()
             
-            print(f"[成功] 檔案已儲存: {filename}")
-            return True
+                print(f"[成功] 檔案已儲存: {filename}")
+                return True
 
     except aiohttp.ClientError as e:
-        print(f"[連線錯誤] 無法連接伺服器: {e}")
+        print(f"[連線錯誤] 無法連接伺服器 {domain}: {e}")
+        return False
+    except asyncio.TimeoutError:
+        print(f"[連線錯誤] {domain} 連線逾時")
         return False
     except Exception as e:
         print(f"[系統錯誤] 發生未預期錯誤: {e}")
         return False
 
 
+async def download_batch(session: aiohttp.ClientSession, mall_indices: list, e5_dates: list,
+                         concurrency: int = DOWNLOAD_CONCURRENCY) -> dict:
+    """
+    同時下載多個 (商城, 日期) 組合的報表 (共用同一個 session)
+    以 Semaphore 限制同時連線數；多個日期時檔名加上日期
+    回傳: {(網域, 日期): True/False}
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    with_date = len(e5_dates) > 1
+    jobs = [(idx, e5_date) for idx in mall_indices for e5_date in e5_dates]
+
+    async def run_one(idx: int, e5_date: str) -> bool:
+        async with semaphore:
+            return await download_report(session, idx, e5_date, with_date)
+
+    results = await asyncio.gather(
+        *(run_one(idx, e5_date) for idx, e5_date in jobs),
+        return_exceptions=True,
+    )
+    # download_report 已自行處理錯誤，這裡的例外視為失敗
+    return {
+        (HOST_API_LIST[idx], e5_date): result is True
+        for (idx, e5_date), result in zip(jobs, results)
+    }
+
+
+def job_label(domain: str, e5_date: str, with_date: bool) -> str:
+    """摘要中顯示的任務名稱"""
+    if not with_date:
+        return domain
+    return f"{domain} (前 {e5_date} 天)" if e5_date else f"{domain} (今天)"
+
+
+def print_summary(results: dict):
+    """顯示各任務的下載結果摘要"""
+    with_date = len({e5_date for _, e5_date in results}) > 1
+    print("-" * 30)
+    for (domain, e5_date), is_success in results.items():
+        print(f"{'成功' if is_success else '失敗'}  {job_label(domain, e5_date, with_date)}")
+    print("-" * 30)
+    success_count = sum(1 for ok in results.values() if ok)
+    print(f"共 {len(results)} 項，成功 {success_count}，失敗 {len(results) - success_count}")
+
+
+async def ask_dates() -> list:
+    """詢問日期，格式錯誤時重新詢問"""
+    while True:
+        date_input = await get_input(DATE_PROMPT)
+        try:
+            return parse_date_offsets(date_input)
+        except ValueError as e:
+            print(f"[提示] {e}，請重新輸入。")
+
+
 async def process_shipping_task(choice: int, session: aiohttp.ClientSession):
     """
-    處理寄件報表匯出的單一任務邏輯
+    處理寄件報表匯出的單一商城任務邏輯
     包含：範圍檢查、詢問日期、呼叫下載、結果顯示
     """
     # 1. 範圍檢核
@@ -139,10 +401,15 @@ async def process_shipping_task(choice: int, session: aiohttp.ClientSession):
     
     try:
         # 3. 輸入日期 (這是任務的一部分，所以在這邊詢問)
-        date_input = await get_input('請輸入您欲匯出的日期 (今天不輸入，前一天1，前兩天2，以此類推...): ')
+        e5_dates = await ask_dates()
         
         # 4. 執行下載
-        is_success = await download_report(session, target_mall_idx, date_input)
+        if len(e5_dates) == 1:
+            is_success = await download_report(session, target_mall_idx, e5_dates[0])
+        else:
+            results = await download_batch(session, [target_mall_idx], e5_dates)
+            print_summary(results)
+            is_success = all(results.values())
         
         # 5. 顯示結果
         print("-" * 30)
@@ -153,15 +420,107 @@ async def process_shipping_task(choice: int, session: aiohttp.ClientSession):
         print(f"[任務錯誤] 處理過程發生異常: {str(e)}")
         await get_input('按任意鍵繼續...')
 
+
+async def process_all_shipping_task(session: aiohttp.ClientSession):
+    """
+    處理全部商城的寄件報表匯出
+    包含：詢問日期、同時下載、各商城結果摘要
+    """
+    if not HOST_API_LIST:
+        print("[錯誤] 尚未載入任何網域，無法執行操作。")
+        await get_input('請按 Enter 鍵返回主選單...')
+        return
+
+    print(f"已選擇: 全部商城 (共 {len(HOST_API_LIST)} 個，同時下載上限 {DOWNLOAD_CONCURRENCY})")
+
+    try:
+        e5_dates = await ask_dates()
+
+        results = await download_batch(session, list(range(len(HOST_API_LIST))), e5_dates)
+
+        print_summary(results)
+        print("匯出完畢" if all(results.values()) else "部分商城發生錯誤")
+        await get_input('請按 Enter 鍵返回主選單...')
+
+    except Exception as e:
+        print(f"[任務錯誤] 處理過程發生異常: {str(e)}")
+        await get_input('按任意鍵繼續...')
+
+# ==========================================
+# 4. 命令列模式 (Headless CLI)
+# ==========================================
+def parse_args(argv: list) -> argparse.Namespace:
+    """解析命令列參數 (有帶參數時以無人值守模式執行，可供排程使用)"""
+    parser = argparse.ArgumentParser(
+        description=f'{WINDOW_TITLE} - 命令列模式，結果以 JSON 輸出到 stdout')
+    parser.add_argument('--domains', default='all',
+                        help='商城網域，逗號分隔；all 代表 domain.txt 中全部商城 (預設 all)')
+    parser.add_argument('--action', choices=['download'], default='download',
+                        help='執行動作 (預設 download: 下載寄件報表)')
+    parser.add_argument('--date', default='',
+                        help='日期，今天留空，前一天 1；可用範圍 0-6 或列表 1,3,5')
+    parser.add_argument('--concurrency', type=int, default=DOWNLOAD_CONCURRENCY,
+                        help=f'同時下載上限 (預設 {DOWNLOAD_CONCURRENCY})')
+    return parser.parse_args(argv)
+
+
+def resolve_domains(domains_arg: str) -> list:
+    """將 --domains 參數轉為 HOST_API_LIST 的索引列表，未知網域拋出 ValueError"""
+    if domains_arg.strip().lower() == 'all':
+        return list(range(len(HOST_API_LIST)))
+    indices = []
+    for domain in (d.strip() for d in domains_arg.split(',')):
+        if not domain:
+            continue
+        if domain not in HOST_API_LIST:
+            raise ValueError(f"未知的網域: {domain}")
+        indices.append(HOST_API_LIST.index(domain))
+    return indices
+
+
+async def run_headless(args: argparse.Namespace) -> int:
+    """
+    無人值守執行下載，過程訊息輸出到 stderr，JSON 摘要輸出到 stdout
+    回傳結束碼: 0 (全部成功), 1 (有失敗), 2 (參數錯誤)
+    """
+    summary = {'program': PROGRAM_NAME, 'version': TOOL_VERSION, 'action': args.action}
+    try:
+        mall_indices = resolve_domains(args.domains)
+        e5_dates = parse_date_offsets(args.date)
+        if not mall_indices:
+            raise ValueError("沒有可執行的網域")
+    except ValueError as e:
+        summary['error'] = str(e)
+        print(json.dumps(summary, ensure_ascii=False))
+        return 2
+
+    stats = ConnectionStats()
+    with redirect_stdout(sys.stderr):
+        async with create_session(stats) as session:
+            results = await download_batch(session, mall_indices, e5_dates, args.concurrency)
+        stats.report()
+
+    with_date = len(e5_dates) > 1
+    summary['results'] = [
+        {'domain': domain, 'date': e5_date, 'file': report_filename(domain, e5_date, with_date),
+         'success': is_success}
+        for (domain, e5_date), is_success in results.items()
+    ]
+    summary['success'] = sum(1 for ok in results.values() if ok)
+    summary['failed'] = len(results) - summary['success']
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0 if summary['failed'] == 0 else 1
+
 # ==========================================
-# 4. 主程式入口 (Entry Point)
+# 5. 主程式入口 (Entry Point)
 # ==========================================
 async def main():
     """主選單"""
     print(f"[啟動] {PROGRAM_NAME} 正在初始化...")
     
-    # 使用 aiohttp 建立一個共用的 Session
-    async with aiohttp.ClientSession() as session:
+    # 使用 aiohttp 建立一個共用的 Session (連線池設定見 http_client.py)
+    stats = ConnectionStats()
+    async with create_session(stats) as session:
         while True:
             try:
                 # 1. 顯示選單
@@ -184,7 +543,10 @@ async def main():
                     break
                 
                 # 呼叫任務處理函式 (將邏輯轉發出去)
-                await process_shipping_task(choice, session)
+                if choice == len(HOST_API_LIST) + 1:
+                    await process_all_shipping_task(session)
+                else:
+                    await process_shipping_task(choice, session)
                 
             except KeyboardInterrupt:
                 print("\n[系統] 使用者強制中斷程式 (Ctrl+C)")
@@ -193,8 +555,17 @@ async def main():
                 print(f"\n[致命錯誤] 主迴圈錯誤: {str(e)}")
                 await asyncio.sleep(1)
 
+    # 顯示連線重複使用狀況，確認 TLS 握手有被分攤
+    stats.report()
+
 
 if __name__ == "__main__":
+    # 有帶命令列參數時以無人值守模式執行 (排程用)，不進入選單也不等待輸入
+    if len(sys.argv) > 1:
+        if sys.platform == 'win32':
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        sys.exit(asyncio.run(run_headless(parse_args(sys.argv[1:]))))
+
     try:
         # Windows 平台下的 Event Loop 策略修正 (Python 3.8+ 在 Windows 上的 asyncio 限制)
         if sys.platform == 'win32':
@@ -1,9 +1,14 @@
+import argparse
+import ast
 import asyncio
+import csv
 import os
 import json
 import sys
 import traceback
 import aiohttp
+from contextlib import nullcontext, redirect_stdout
+from http_client import ConnectionStats, create_session
 
 # 設置行緩衝
 sys.stdout = os.fdopen(sys.stdout.fileno(), "w", 1)
@@ -37,11 +42,11 @@ def load_domains(filename='domain.txt'):
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 domains = [line.strip() for line in f if line.strip()]
-            print(f"[系統] 已從 {filename} 載入 {len(domains)} 個網域。")
+            print(f"[系統] 已從 {filename} 載入 {len(domains)} 個網域。", file=sys.stderr)
         except Exception as e:
-            print(f"[錯誤] 讀取網域設定檔失敗: {e}")
+            print(f"[錯誤] 讀取網域設定檔失敗: {e}", file=sys.stderr)
     else:
-        print(f"[警告] 找不到 {file_path}，請確保檔案存在。")
+        print(f"[警告] 找不到 {file_path}，請確保檔案存在。", file=sys.stderr)
     return domains
 
 # 初始化載入
@@ -59,6 +64,45 @@ FILE_MAP = {
     'purchase': '3.txt'
 }
 
+# 匯入類型 (選單順序) 與對應的 API 端點
+ACTION_TYPES = [
+    ('address', '匯入地址'),
+    ('order', '匯入訂單'),
+    ('purchase', '匯入採購單'),
+]
+ENDPOINT_MAP = {
+    'address': '/import_address',
+    'order': '/f7_import_order',
+    'purchase': '/f9_import_purorder'
+}
+
+# 全部商城模式的同時匯入上限
+IMPORT_CONCURRENCY = 5
+
+# 分批上傳設定 (僅訂單與採購單；地址檔需整份匯入)
+BATCHED_ACTIONS = {'order', 'purchase'}
+IMPORT_BATCH_ROWS = 500  # 每批列數 (csv 記錄數)
+IMPORT_BATCH_RETRIES = 3  # 每批無法連線時的最大重試次數 (內容已送出的失敗不重試，避免重複匯入)
+IMPORT_BATCH_TIMEOUT = 120  # 每批上傳逾時 (秒)
+IMPORT_RETRY_DELAY = 1  # 重試初始等待時間 (秒)，之後指數遞增
+
+# 壓縮上傳 (None: 不壓縮；'gzip': 上傳時邊讀邊壓縮，不在記憶體中先產生壓縮檔)
+# 商城不接受壓縮內容時自動改用一般上傳，並記住該商城
+UPLOAD_COMPRESSION = None
+COMPRESSION_REJECT_STATUS = {400, 411, 415}
+
+# 分批上傳進度檔 (記錄每個商城已確認的列數，失敗後從該處續傳)
+PROGRESS_FILE = os.path.join(SCRIPT_DIR, 'import_progress.json')
+
+# 上傳前檢查：各檔案的欄位數與數值欄位 (欄位索引從 0 開始)
+# address 檔格式由伺服器決定，這裡只檢查非空白
+VALIDATION_RULES = {
+    'address': {'columns': None, 'numeric': (), 'digits': (), 'items': None},
+    'order': {'columns': 11, 'numeric': (4, 5), 'digits': (0, 2), 'items': 3},
+    'purchase': {'columns': 9, 'numeric': (5,), 'digits': (4, 6), 'items': None},
+}
+MAX_REPORTED_ERRORS = 20  # 最多列出的錯誤行數 (其餘只計數)
+
 # ============================================ 
 # 2. 工具函式 (Utilities)
 # ============================================ 
@@ -74,6 +118,182 @@ async def get_input(prompt: str) -> str:
     """
     return await asyncio.get_event_loop().run_in_executor(None, input, prompt)
 
+
+def load_progress() -> dict:
+    """載入分批上傳進度，檔案不存在或損毀時回傳空字典"""
+    if not os.path.exists(PROGRESS_FILE):
+        return {}
+    try:
+        with open(PROGRESS_FILE, 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+        return progress if isinstance(progress, dict) else {}
+    except Exception as e:
+        print(f"[警告] 讀取上傳進度失敗，將從頭上傳: {e}", file=sys.stderr)
+        return {}
+
+
+def save_progress():
+    """寫回分批上傳進度 (先寫暫存檔再改名，避免寫到一半損毀)"""
+    temp_file = f'{PROGRESS_FILE}.tmp'
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(UPLOAD_PROGRESS, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, PROGRESS_FILE)
+    except Exception as e:
+        print(f"[警告] 寫入上傳進度失敗: {e}")
+
+
+def progress_key(target_host: str, action: str, file_path: str) -> str:
+    """進度鍵值: (商城, 匯入類型, 檔案大小與修改時間)；檔案內容變更後不會誤續傳"""
+    stat = os.stat(file_path)
+    return f'{target_host}|{action}|{stat.st_size}|{stat.st_mtime_ns}'
+
+
+def iter_row_batches(file_path: str, batch_rows: int, skip_rows: int = 0):
+    """
+    逐筆讀取 csv 記錄並依筆數切批 (不一次載入整個檔案)
+    與檢查時相同以 csv 記錄為單位，引號內含換行的記錄不會被切開，空白列略過不計；各批保留原始內容
+    產生: (起始列索引, 該批列數, 該批內容 bytes)，列索引與 validate_import_file 的資料列數一致
+    """
+    raw_lines = []  # 目前這筆記錄的原始行
+
+    def read_lines(f):
+        for line in f:
+            raw_lines.append(line)
+            yield line
+
+    batch = []
+    start_row = skip_rows
+    # 不去除 BOM (utf-8-sig)，第一批內容與原檔相同
+    row_idx = 0  # 資料列索引 (不含空白列)
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(read_lines(f)):
+            record = ''.join(raw_lines)
+            raw_lines.clear()
+            # 與 validate_import_file 相同略過空白列 (第一列可能帶有 BOM)
+            if not any(field.replace('\ufeff', '').strip() for field in row):
+                continue
+            row_idx += 1
+            if row_idx <= skip_rows:
+                continue
+            batch.append(record)
+            if len(batch) >= batch_rows:
+                yield start_row, len(batch), ''.join(batch).encode('utf-8')
+                start_row += len(batch)
+                batch = []
+    if batch:
+        yield start_row, len(batch), ''.join(batch).encode('utf-8')
+
+
+
+def is_number(value: str) -> bool:
+    """檢查字串是否為數字 (整數或小數)"""
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def check_items(value: str) -> str:
+    """
+    檢查訂單的商品欄位 (Python 字面值格式的 list，例如 [{'name': '商品A', 'qty': 1, 'price': 1000}])
+    使用 ast.literal_eval 安全解析，回傳錯誤訊息 (無錯誤回傳空字串)
+    """
+    try:
+        items = ast.literal_eval(value)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return '商品欄位無法解析'
+    if not isinstance(items, list) or not items:
+        return '商品欄位必須是非空的列表'
+    for item in items:
+        if not isinstance(item, dict):
+            return '商品欄位的項目必須是字典'
+        qty, price = item.get('qty'), item.get('price')
+        if not isinstance(qty, int) or isinstance(qty, bool) or qty <= 0:
+            return f'商品數量錯誤: {qty!r}'
+        if not isinstance(price, (int, float)) or isinstance(price, bool) or price < 0:
+            return f'商品價格錯誤: {price!r}'
+    return ''
+
+
+def check_row(row: list, rules: dict) -> str:
+    """依規則檢查單列，回傳錯誤訊息 (無錯誤回傳空字串)"""
+    if rules['columns'] is not None and len(row) != rules['columns']:
+        return f"欄位數應為 {rules['columns']}，實際為 {len(row)}"
+    for col in rules['digits']:
+        if not row[col].strip().isdigit():
+            return f'第 {col + 1} 欄應為數字: {row[col]!r}'
+    for col in rules['numeric']:
+        if not is_number(row[col].strip()):
+            return f'第 {col + 1} 欄應為數值: {row[col]!r}'
+    if rules['items'] is not None:
+        return check_items(row[rules['items']])
+    return ''
+
+
+def validate_import_file(file_path: str, action: str, max_errors: int = MAX_REPORTED_ERRORS) -> tuple:
+    """
+    上傳前逐列檢查匯入檔 (csv 串流讀取，記憶體用量固定)
+    回傳: (資料列數, 錯誤列數, [(行號, 錯誤訊息), ...] 最多 max_errors 筆)
+    """
+    rules = VALIDATION_RULES[action]
+    row_count = error_count = 0
+    errors = []
+
+    def add_error(line_num: int, message: str):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < max_errors:
+            errors.append((line_num, message))
+
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        try:
+            for row in reader:
+                if not any(field.strip() for field in row):
+                    continue  # 略過空白列
+                row_count += 1
+                message = check_row(row, rules)
+                if message:
+                    add_error(reader.line_num, message)
+        except UnicodeDecodeError as e:
+            add_error(reader.line_num + 1, f'檔案編碼錯誤 (需為 UTF-8): {e.reason}')
+        except csv.Error as e:
+            add_error(reader.line_num, f'CSV 格式錯誤: {e}')
+
+    if row_count == 0 and error_count == 0:
+        add_error(0, '檔案沒有任何資料')
+    return row_count, error_count, errors
+
+
+def validate_before_upload(action: str) -> bool:
+    """上傳前檢查匯入檔並顯示結果，回傳是否可以上傳"""
+    file_name = FILE_MAP[action]
+    full_file_path = os.path.join(SCRIPT_DIR, file_name)
+    if not os.path.exists(full_file_path):
+        print(f"錯誤! 找不到檔案: {full_file_path}")
+        return False
+
+    print(f'正在檢查檔案: {file_name} ...')
+    row_count, error_count, errors = validate_import_file(full_file_path, action)
+    if error_count == 0:
+        print(f'檢查通過，共 {row_count} 筆資料')
+        return True
+
+    print(f'錯誤! {file_name} 共 {error_count} 列格式錯誤 (資料 {row_count} 筆)，已取消上傳:')
+    for line_num, message in errors:
+        print(f'  第 {line_num} 行: {message}')
+    if error_count > len(errors):
+        print(f'  ... 其餘 {error_count - len(errors)} 列未列出')
+    return False
+
+# 初始化載入上傳進度
+UPLOAD_PROGRESS = load_progress()
+
+# 不接受壓縮上傳的商城 (執行期間記住，避免每次都先失敗一次)
+COMPRESSION_REJECTED_HOSTS = set()
+
 # ============================================ 
 # 3. 核心邏輯 (Core Logic)
 # ============================================ 
@@ -85,18 +305,208 @@ def show_menu():
     print('-' * 30)
     
     cnt = 1
-    action_types = ["匯入地址", "匯入訂單", "匯入採購單"]
 
-    for action_type in action_types:
+    for _, action_name in ACTION_TYPES:
         for host in HOST_API_LIST:
-            print(f"{cnt}.{action_type}: {host}")
+            print(f"{cnt}.{action_name}: {host}")
             cnt += 1
         print('=' * 30)
+
+    # 全部商城 (編號接在單一商城選項之後)
+    for _, action_name in ACTION_TYPES:
+        print(f"{cnt}.{action_name}: 全部商城")
+        cnt += 1
+    print('=' * 30)
         
     print('0.結 束 程 式')
     print('-' * 30)
 
 
+async def check_pending_orders(session: aiohttp.ClientSession, target_host: str) -> tuple:
+    """
+    驗證剩餘單數 (地址匯入特有邏輯)，剩餘單數必須為 0 才能匯入
+    回傳: (是否通過, 訊息)
+    """
+    check_url = f'https://apiinternal.{target_host}/query_pending_orders'
+    postbody = {'d1_password': PWD_QUERY_PENDING}
+
+    print(f'正在連線驗證: {check_url} ...')
+    try:
+        # 設定 headers 確保 json 傳輸正確
+        headers = {'Content-Type': 'application/json'}
+        async with session.post(check_url, json=postbody, headers=headers, timeout=600) as response:
+            resp_text = await response.text()
+            print(f'[{target_host}] 檢查回應文字: {resp_text}')
+            print(f'[{target_host}] 檢查狀態碼: {response.status}')
+    except Exception as e:
+        return False, f"驗證API失敗: {str(e)}"
+
+    try:
+        resp_json = json.loads(resp_text)
+    except json.JSONDecodeError:
+        return False, f'回傳格式異常: {resp_text}'
+    if str(resp_json.get('data')) != '0':
+        return False, f'米匯寶-匯入地址資料程式-剩餘單數不為0! 剩餘單數: {resp_text}'
+    return True, ''
+
+
+async def import_to_host(session: aiohttp.ClientSession, action: str, target_host: str) -> tuple:
+    """
+    對單一商城執行匯入 (不詢問使用者，單一商城與全部商城模式共用)
+    action: 'address' / 'order' / 'purchase'
+    回傳: (是否成功, 訊息)
+    """
+    file_name = FILE_MAP[action]
+    endpoint = ENDPOINT_MAP[action]
+    # 採購單使用專屬密碼
+    current_password = PWD_PURCHASE_ACTION if action == 'purchase' else PWD_IMPORT_ACTION
+
+    # 1. 地址匯入前先驗證剩餘單數
+    if action == 'address':
+        is_passed, message = await check_pending_orders(session, target_host)
+        if not is_passed:
+            return False, message
+
+    # 2. 統一組裝 API URL
+    api_url = f'https://apiinternal.{target_host}{endpoint}?password={current_password}'
+    print(f'選擇的商城: {target_host} URL: {api_url}')
+
+    # 3. 執行檔案上傳
+    full_file_path = os.path.join(SCRIPT_DIR, file_name)
+    if not os.path.exists(full_file_path):
+        return False, f"找不到檔案: {full_file_path}"
+
+    if action in BATCHED_ACTIONS:
+        return await upload_in_batches(session, api_url, action, target_host, full_file_path)
+
+    try:
+        # 讀取檔案並上傳
+        status, resp_text = await post_import_file(session, api_url, target_host, file_name,
+                                                   full_file_path, timeout=10)
+        if status == 200:
+            return True, resp_text
+        return False, f"HTTP {status} - 響應資訊:{resp_text}"
+
+    except Exception as e:
+        return False, f'處理失敗! {str(e)}'
+
+
+async def post_import_file(session: aiohttp.ClientSession, api_url: str, target_host: str,
+                           file_name: str, source, timeout: float) -> tuple:
+    """
+    以 multipart 上傳檔案內容
+    source: 檔案路徑 (串流讀取) 或 bytes (分批內容)
+    啟用 UPLOAD_COMPRESSION 時由 aiohttp 邊傳邊壓縮 (Content-Encoding)，
+    商城拒絕時改用一般上傳重送一次，之後該商城都不再壓縮
+    回傳: (HTTP 狀態碼, 響應文字)
+    """
+    compress = UPLOAD_COMPRESSION if target_host not in COMPRESSION_REJECTED_HOSTS else None
+
+    while True:
+        data = aiohttp.FormData()
+        # 注意: 這裡使用 with open 確保檔案在上傳後正確關閉
+        with open(source, 'rb') if isinstance(source, str) else nullcontext(source) as payload:
+            data.add_field('file', payload, filename=file_name, content_type='text/plain')
+
+            async with session.post(api_url, data=data, compress=compress, timeout=timeout) as response:
+                resp_text = await response.text()
+                status = response.status
+
+        if compress and status in COMPRESSION_REJECT_STATUS:
+            print(f'[{target_host}] 不接受壓縮上傳 (HTTP {status})，改用一般上傳')
+            COMPRESSION_REJECTED_HOSTS.add(target_host)
+            compress = None
+            continue
+        return status, resp_text
+
+
+async def upload_in_batches(session: aiohttp.ClientSession, api_url: str, action: str,
+                            target_host: str, full_file_path: str) -> tuple:
+    """
+    依 IMPORT_BATCH_ROWS 將檔案切批依序上傳，只在連線尚未建立 (內容沒有送出) 時重試；
+    逾時或非 200 時商城可能已匯入該批，不自動重送，請確認後再執行
+    每批成功後記錄進度，失敗的執行下次會從最後確認的列數續傳
+    回傳: (是否成功, 訊息)
+    """
+    file_name = os.path.basename(full_file_path)
+    key = progress_key(target_host, action, full_file_path)
+    acked_rows = UPLOAD_PROGRESS.get(key, 0)
+    if acked_rows:
+        print(f'[{target_host}] 從第 {acked_rows + 1} 列續傳')
+
+    batch_count = 0
+    resp_text = ''
+    for start_row, row_count, payload in iter_row_batches(full_file_path, IMPORT_BATCH_ROWS, acked_rows):
+        rows_label = f'第 {start_row + 1} ~ {start_row + row_count} 列'
+        for attempt in range(IMPORT_BATCH_RETRIES + 1):
+            try:
+                status, resp_text = await post_import_file(session, api_url, target_host, file_name,
+                                                           payload, timeout=IMPORT_BATCH_TIMEOUT)
+                break
+            except aiohttp.ClientConnectorError as e:
+                # 連線尚未建立，本批內容沒有送出，可以安全重試
+                error = str(e) or type(e).__name__
+                if attempt >= IMPORT_BATCH_RETRIES:
+                    return False, f'{rows_label}無法連線: {error}，下次執行將從第 {start_row + 1} 列續傳'
+                wait_time = IMPORT_RETRY_DELAY * (2 ** attempt)
+                print(f'[{target_host}] {rows_label}無法連線: {error}，'
+                      f'{wait_time} 秒後重試 ({attempt + 1}/{IMPORT_BATCH_RETRIES})')
+                await asyncio.sleep(wait_time)
+            except Exception as e:
+                # 內容可能已送出 (逾時、連線中斷)，商城可能已匯入本批，不自動重送
+                error = str(e) or type(e).__name__
+                return False, (f'{rows_label}上傳結果不明: {error}，商城可能已匯入本批，'
+                               f'請確認後再執行 (下次執行將從第 {start_row + 1} 列續傳)')
+
+        if status != 200:
+            return False, (f'{rows_label}上傳失敗: HTTP {status} - 響應資訊:{resp_text}，'
+                           f'請確認商城是否已匯入本批後再執行 (下次執行將從第 {start_row + 1} 列續傳)')
+
+        # 本批已確認，記錄進度
+        batch_count += 1
+        UPLOAD_PROGRESS[key] = start_row + row_count
+        save_progress()
+        print(f'[{target_host}] 已上傳至第 {start_row + row_count} 列')
+
+    # 全部完成，清除進度記錄
+    total_rows = UPLOAD_PROGRESS.pop(key, acked_rows)
+    save_progress()
+    return True, f'共 {batch_count} 批 (至第 {total_rows} 列) 上傳完成，最後響應: {resp_text}'
+
+
+async def broadcast_import(session: aiohttp.ClientSession, action: str,
+                           concurrency: int = IMPORT_CONCURRENCY, hosts: list = None) -> dict:
+    """
+    同時對多個商城執行匯入 (共用同一個 session)，hosts 未指定時為全部商城
+    以 Semaphore 限制同時上傳數，回傳: {host: (是否成功, 訊息)}
+    """
+    hosts = HOST_API_LIST if hosts is None else hosts
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(host: str) -> tuple:
+        async with semaphore:
+            return await import_to_host(session, action, host)
+
+    results = await asyncio.gather(
+        *(run_one(host) for host in hosts),
+        return_exceptions=True,
+    )
+    return {
+        host: result if isinstance(result, tuple) else (False, f'未預期錯誤: {result}')
+        for host, result in zip(hosts, results)
+    }
+
+
+def print_result_table(results: dict):
+    """顯示各商城匯入結果彙總表"""
+    print('-' * 30)
+    for host, (is_success, message) in results.items():
+        print(f"{'成功' if is_success else '失敗'}  {host}  {message}")
+    print('-' * 30)
+    success_count = sum(1 for is_success, _ in results.values() if is_success)
+    print(f"共 {len(results)} 個商城，成功 {success_count}，失敗 {len(results) - success_count}")
+
+
 async def process_import_task(select_mall: int, session: aiohttp.ClientSession):
     """處理匯入邏輯"""
     list_len = len(HOST_API_LIST)
@@ -105,100 +515,49 @@ async def process_import_task(select_mall: int, session: aiohttp.ClientSession):
         await get_input('按 Enter 鍵返回...')
         return
 
-    # 0. 基礎檢核
-    if select_mall < 1 or select_mall > 3 * list_len:
+    # 0. 基礎檢核 (單一商城 1 ~ 3N，全部商城 3N+1 ~ 3N+3)
+    if select_mall < 1 or select_mall > 3 * list_len + len(ACTION_TYPES):
         print("無效的選項")
         await asyncio.sleep(1)
         return
 
-    # 1. 共通邏輯：計算並顯示商城
-    # 利用餘數計算索引 (例如 1, 17, 33 對應同一個 host)
-    idx = (select_mall - 1) % list_len
-    target_host = HOST_API_LIST[idx]
-    # print(f'選擇的商城: {target_host}') # Moved to after URL construction
+    # 1. 依區段決定匯入類型 (地址 1 ~ 16、訂單 17 ~ 32、採購單 33 ~ 48、全部商城 49 ~ 51)
+    is_broadcast = select_mall > 3 * list_len
+    if is_broadcast:
+        action, action_name = ACTION_TYPES[select_mall - 3 * list_len - 1]
+    else:
+        action, action_name = ACTION_TYPES[(select_mall - 1) // list_len]
 
-    file_name = ""
-    endpoint = ""
-    current_password = PWD_IMPORT_ACTION # 預設為 PWD_IMPORT_ACTION
-    
-    # 2. 分歧邏輯：設定檔案、端點與執行特殊檢查
     try:
-        # === 匯入地址 (選項 1 ~ 16) ===
-        if select_mall <= list_len:
-            file_name = FILE_MAP['address']
-            endpoint = '/import_address'
-
-            # 驗證剩餘單數 (地址匯入特有邏輯)
-            check_url = f'https://apiinternal.{target_host}/query_pending_orders'
-            postbody = {'d1_password': PWD_QUERY_PENDING}
-            
-            print(f'正在連線驗證: {check_url} ...')
-            try:
-                # 設定 headers 確保 json 傳輸正確
-                headers = {'Content-Type': 'application/json'}
-                async with session.post(check_url, json=postbody, headers=headers, timeout=600) as response:
-                    resp_text = await response.text()
-                    print(f'檢查回應文字: {resp_text}')
-                    print(f'檢查狀態碼: {response.status}')
-                    try:
-                        resp_json = json.loads(resp_text)
-                        if str(resp_json.get('data')) != '0':
-                            print(f'錯誤! 米匯寶-匯入地址資料程式-剩餘單數不為0! 剩餘單數: {resp_text}')
-                            await get_input('請確認錯誤(匯入地址)')
-                            return
-                    except json.JSONDecodeError:
-                        print(f'錯誤! 回傳格式異常: {resp_text}')
-                        return
+        # 2. 上傳前先在本地檢查檔案格式，避免浪費伺服器往返時間
+        if not validate_before_upload(action):
+            await get_input('請修正檔案後再匯入')
+            return
 
-            except Exception as e:
-                print(f"驗證API失敗: {str(e)}")
-                await get_input('請確認錯誤(驗證階段)')
-                return
-
-        # === 匯入訂單 (選項 17 ~ 32) ===
-        elif select_mall <= 2 * list_len:
-            file_name = FILE_MAP['order']
-            endpoint = '/f7_import_order'
-
-        # === 匯入採購單 (選項 33 ~ 48) ===
-        else:
-            file_name = FILE_MAP['purchase']
-            endpoint = '/f9_import_purorder'
-            current_password = PWD_PURCHASE_ACTION # 採購單使用專屬密碼
-
-        # 3. 統一組裝 API URL
-        api_url = f'https://apiinternal.{target_host}{endpoint}?password={current_password}'
-        print(f'選擇的商城: {target_host} URL: {api_url}')
-
-        # 4. 執行檔案上傳
-        full_file_path = os.path.join(SCRIPT_DIR, file_name)
-        if not os.path.exists(full_file_path):
-            print(f"錯誤! 找不到檔案: {full_file_path}")
-            await get_input('請確認檔案是否存在')
+        # === 全部商城 ===
+        if is_broadcast:
+            print(f'{action_name}: 全部商城 (共 {list_len} 個，同時匯入上限 {IMPORT_CONCURRENCY})')
+            print('資料處理中，請勿做其他動作。')
+
+            results = await broadcast_import(session, action)
+            print_result_table(results)
+            await get_input('匯入完畢,請按任意鍵返回主選單')
             return
 
+        # === 單一商城 ===
+        # 利用餘數計算索引 (例如 1, 17, 33 對應同一個 host)
+        idx = (select_mall - 1) % list_len
+        target_host = HOST_API_LIST[idx]
+
         print('資料處理中，請勿做其他動作。')
-        
-        try:
-            # 讀取檔案並上傳
-            data = aiohttp.FormData()
-            # 注意: 這裡使用 with open 確保檔案在上傳後正確關閉
-            with open(full_file_path, 'rb') as f:
-                data.add_field('file', f, filename=file_name, content_type='text/plain')
-                
-                async with session.post(api_url, data=data, timeout=10) as response:
-                    resp_text = await response.text()
-                    if response.status == 200:
-                        print("上傳成功")
-                        print(f"響應資訊: {resp_text}")
-                    else:
-                        print(f"上傳失敗 HTTP {response.status} - 響應資訊:{resp_text}")
-                        
-        except Exception as e:
-            print(f'錯誤! 處理失敗! {str(e)}')
+        is_success, message = await import_to_host(session, action, target_host)
+        if not is_success:
+            print(f'錯誤! {message}')
             await get_input('請確認錯誤')
             return
 
+        print("上傳成功")
+        print(f"響應資訊: {message}")
         await get_input('匯入完畢,請按任意鍵返回主選單')
 
     except Exception as e:
@@ -207,11 +566,85 @@ async def process_import_task(select_mall: int, session: aiohttp.ClientSession):
         await get_input('按任意鍵繼續...')
 
 # ============================================ 
-# 4. 主程式入口 (Entry Point)
+# 4. 命令列模式 (Headless CLI)
+# ============================================ 
+def parse_args(argv: list) -> argparse.Namespace:
+    """解析命令列參數 (有帶參數時以無人值守模式執行，可供排程使用)"""
+    parser = argparse.ArgumentParser(
+        description=f'{WINDOW_TITLE} - 命令列模式，結果以 JSON 輸出到 stdout')
+    parser.add_argument('--domains', default='all',
+                        help='商城網域，逗號分隔；all 代表 domain.txt 中全部商城 (預設 all)')
+    parser.add_argument('--action', choices=list(FILE_MAP), required=True,
+                        help='匯入類型: address (1.txt) / order (2.txt) / purchase (3.txt)')
+    parser.add_argument('--concurrency', type=int, default=IMPORT_CONCURRENCY,
+                        help=f'同時匯入上限 (預設 {IMPORT_CONCURRENCY})')
+    parser.add_argument('--compress', action='store_true',
+                        help='以 gzip 壓縮上傳 (商城不接受時自動改用一般上傳)')
+    return parser.parse_args(argv)
+
+
+def resolve_domains(domains_arg: str) -> list:
+    """將 --domains 參數轉為商城列表，未知網域拋出 ValueError"""
+    if domains_arg.strip().lower() == 'all':
+        return list(HOST_API_LIST)
+    hosts = []
+    for host in (d.strip() for d in domains_arg.split(',')):
+        if not host:
+            continue
+        if host not in HOST_API_LIST:
+            raise ValueError(f"未知的網域: {host}")
+        hosts.append(host)
+    return hosts
+
+
+async def run_headless(args: argparse.Namespace) -> int:
+    """
+    無人值守執行匯入，過程訊息輸出到 stderr，JSON 摘要輸出到 stdout
+    回傳結束碼: 0 (全部成功), 1 (有失敗或檔案檢查未通過), 2 (參數錯誤)
+    """
+    global UPLOAD_COMPRESSION
+    summary = {'program': PROGRAM_NAME, 'version': TOOL_VERSION, 'action': args.action}
+    try:
+        hosts = resolve_domains(args.domains)
+        if not hosts:
+            raise ValueError("沒有可執行的網域")
+    except ValueError as e:
+        summary['error'] = str(e)
+        print(json.dumps(summary, ensure_ascii=False))
+        return 2
+
+    if args.compress:
+        UPLOAD_COMPRESSION = 'gzip'
+
+    stats = ConnectionStats()
+    with redirect_stdout(sys.stderr):
+        is_valid = validate_before_upload(args.action)
+        if is_valid:
+            async with create_session(stats) as session:
+                results = await broadcast_import(session, args.action, args.concurrency, hosts)
+            stats.report()
+
+    if not is_valid:
+        summary['error'] = f'{FILE_MAP[args.action]} 檔案檢查未通過'
+        print(json.dumps(summary, ensure_ascii=False))
+        return 1
+
+    summary['results'] = [
+        {'domain': host, 'success': is_success, 'message': message}
+        for host, (is_success, message) in results.items()
+    ]
+    summary['success'] = sum(1 for is_success, _ in results.values() if is_success)
+    summary['failed'] = len(results) - summary['success']
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0 if summary['failed'] == 0 else 1
+
+# ============================================ 
+# 5. 主程式入口 (Entry Point)
 # ============================================ 
 async def main():
-    # 建立一個長效連接 session
-    async with aiohttp.ClientSession() as session:
+    # 建立一個長效連接 session (連線池設定見 http_client.py)
+    stats = ConnectionStats()
+    async with create_session(stats) as session:
         while True:
             try:
                 show_menu()
@@ -245,11 +678,18 @@ async def main():
                 print(f"\n[致命錯誤] 主迴圈錯誤: {str(e)}")
                 await asyncio.sleep(1)
 
+    # 顯示連線重複使用狀況，確認 TLS 握手有被分攤
+    stats.report()
+
 
 if __name__ == '__main__':
     # Windows 平台修正
     if sys.platform == 'win32':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    # 有帶命令列參數時以無人值守模式執行 (排程用)，不進入選單也不等待輸入
+    if len(sys.argv) > 1:
+        sys.exit(asyncio.run(run_headless(parse_args(sys.argv[1:]))))
         
     try:
         asyncio.run(main())